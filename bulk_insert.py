@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Shared MongoDB bulk-load helpers for the import and migration scripts
+"""
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+from typing import Iterable, Iterator
+from pymongo import MongoClient
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+# Attempts per batch when the connection drops
+INSERT_ATTEMPTS = 3
+
+# Server error code for a unique index violation
+DUPLICATE_KEY_ERROR = 11000
+
+# Shared clients (and connection pools) keyed by connection settings, created on first use
+_clients = {}
+
+def get_client(host: str, username: str, password: str, max_pool_size: int = 100) -> MongoClient:
+    """
+    Return a MongoClient for the given settings, shared by every step of a load
+    
+    Args:
+        host: MongoDB host
+        username: MongoDB username
+        password: MongoDB password
+        max_pool_size: Connection pool size, at least the number of insert workers
+    
+    Returns:
+        Shared MongoClient (connects lazily on first operation)
+    """
+    key = (host, username, password)
+    if key not in _clients:
+        _clients[key] = MongoClient(host=host, port=27017, username=username, password=password,
+                                    authSource='admin', maxPoolSize=max_pool_size)
+    return _clients[key]
+
+def batched(records: Iterable[dict], size: int) -> Iterator[list]:
+    """
+    Split a stream of documents into lists of at most size documents
+    
+    Args:
+        records: Documents to split
+        size: Documents per batch
+    
+    Returns:
+        Iterator of document lists
+    """
+    records = iter(records)
+    return iter(lambda: list(islice(records, size)), [])
+
+def insert_batch(collection, batch: list, bypass_validation: bool = False) -> int:
+    """
+    Insert one batch of documents, retrying if the connection drops
+    
+    Args:
+        collection: Target collection
+        batch: Documents to insert
+        bypass_validation: Skip the collection's validator for this batch.
+            The server rejects the flag on unacknowledged writes, so it is
+            only sent with w>=1.
+    
+    Returns:
+        Number of documents inserted
+    """
+    bypass = bypass_validation and collection.write_concern.acknowledged
+    for attempt in range(1, INSERT_ATTEMPTS + 1):
+        try:
+            result = collection.insert_many(batch, ordered=False, bypass_document_validation=bypass)
+            return len(result.inserted_ids)
+        except AutoReconnect:
+            if attempt == INSERT_ATTEMPTS:
+                raise
+            print(f"Connection lost, retrying batch (attempt {attempt + 1} of {INSERT_ATTEMPTS})")
+        except BulkWriteError as e:
+            # On a retry, documents written before the connection dropped
+            # come back as duplicate keys (their _id was assigned client-side)
+            if attempt == 1 or any(error.get('code') != DUPLICATE_KEY_ERROR for error in e.details.get('writeErrors', [])):
+                raise
+            return len(batch)
+
+def insert_batches(collection, batches: Iterable[list], workers: int, bypass_validation: bool = False) -> int:
+    """
+    Insert batches concurrently, keeping a bounded number in flight so a
+    streamed input is never buffered in full
+    
+    Args:
+        collection: Target collection
+        batches: Iterable of document lists
+        workers: Concurrent insert_many calls
+        bypass_validation: Skip the collection's validator (see insert_batch)
+    
+    Returns:
+        Number of documents inserted
+    """
+    inserted = 0
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch in batches:
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                inserted += sum(future.result() for future in done)
+            pending.add(executor.submit(insert_batch, collection, batch, bypass_validation))
+        inserted += sum(future.result() for future in pending)
+    return inserted
@@ -13,13 +13,265 @@ Functions:
 5. Generate ledger entries
 """
 
+import ast
+import atexit
+import contextlib
+import functools
 import re
-import subprocess
-import json
+import math
 import os
-from typing import Dict, List, Tuple, Any, Optional
+import queue
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, List, Tuple, Any, Optional, Iterable, Iterator, Callable
 from datetime import datetime
 
+import numpy as np
+import orjson
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import OperationFailure
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Field references in formulas, e.g. [subscriptionBalance]
+_FIELD_RE = re.compile(r'\[([^\]]+)\]')
+
+# Supported formula functions, e.g. ABS( -> abs(
+_FUNC_RE = re.compile(r'\b(ABS|ROUND|MAX|MIN|CEIL|FLOOR|SQRT|POW|LOG|LOG10|EXP|SIN|COS|TAN)\s*\(', re.IGNORECASE)
+
+# Filter tokens: a condition like shareClass='A' or an AND/OR connector.
+# Unquoted values may contain spaces and run up to the next AND/OR.
+_FILTER_TOKEN_RE = re.compile(
+    r"""\s*(?:(?P<connector>AND|OR)\b|(?P<field>[A-Za-z_][\w.]*)\s*(?P<op>==|!=|<>|>=|<=|=|>|<)\s*"""
+    r"""(?P<value>'[^']*'|"[^"]*"|[^\s'"](?:[^'"]*?[^\s'"])?)(?=\s+(?:AND|OR)\b|\s*$))\s*""",
+    re.IGNORECASE
+)
+
+# Unquoted numeric filter values
+_NUM_RE = re.compile(r'-?\d+(?:\.\d+)?')
+
+# Unquoted boolean filter values
+_BOOL_VALUES = {'true': True, 'false': False}
+
+# Filter comparison operators -> MongoDB query operators (None for equality)
+_FILTER_OPERATORS = {
+    '=': None, '==': None, '!=': '$ne', '<>': '$ne',
+    '>': '$gt', '>=': '$gte', '<': '$lt', '<=': '$lte'
+}
+
+# Ledger entries per bulk write when writing results to a collection
+OUTPUT_BATCH_SIZE = 1000
+
+# Ledger entries buffered between the aggregation threads and the thread
+# consuming them, bounding memory however large the run
+ENTRY_QUEUE_SIZE = 10000
+
+# Queued by an aggregation thread once its rule group is exhausted
+_GROUP_DONE = object()
+
+# Query results per vectorized formula evaluation (matches the cursor batch size)
+FORMULA_BATCH_SIZE = 1000
+
+# Rows a formula must be applied to before it is compiled with Numba (if installed)
+JIT_THRESHOLD_ROWS = 100000
+
+# orjson options for exported ledger entries
+_JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC
+
+# Default collection for generated ledger entries
+LEDGER_ENTRIES_COLLECTION = 'ledgerEntries'
+
+# Fields identifying a ledger entry; upserts match on them
+LEDGER_ENTRY_KEY = ('ruleName', 'valuationDt', 'account')
+
+# Output field for formulas evaluated inside the aggregation pipeline
+CALCULATED_VALUE_FIELD = 'calculatedValue'
+
+# Ledger definition fields read from MongoDB, with defaults for missing values
+_LEDGER_DEFAULTS = {
+    'ruleName': '',
+    'sourceTable': '',
+    'ledgerDefinition': '',
+    'dataDefinition': '',
+    'filter': '',
+    'status': 'active'
+}
+
+# Largest argument for which math.exp does not overflow
+MAX_EXP_ARGUMENT = math.log(sys.float_info.max)
+
+# Decimal places accepted by the server's $round
+MIN_ROUND_PLACES = -20
+MAX_ROUND_PLACES = 100
+
+# Globals for compiled formula functions
+_SAFE_GLOBALS = {
+    "__builtins__": {},
+    "abs": abs,
+    "round": round,
+    "max": max,
+    "min": min,
+    "ceil": math.ceil,
+    "floor": math.floor,
+    "sqrt": math.sqrt,
+    "pow": pow,
+    "log": math.log,
+    "log10": math.log10,
+    "exp": math.exp,
+    "sin": math.sin,
+    "cos": math.cos,
+    "tan": math.tan
+}
+
+# Globals for formula functions compiled over NumPy field columns
+_NUMPY_GLOBALS = {
+    "__builtins__": {},
+    "abs": np.abs,
+    "round": np.round,
+    "max": lambda *values: functools.reduce(np.maximum, values),
+    "min": lambda *values: functools.reduce(np.minimum, values),
+    "ceil": np.ceil,
+    "floor": np.floor,
+    "sqrt": np.sqrt,
+    "pow": np.power,
+    "log": lambda value, base=None: np.log(value) if base is None else np.log(value) / np.log(base),
+    "log10": np.log10,
+    "exp": np.exp,
+    "sin": np.sin,
+    "cos": np.cos,
+    "tan": np.tan
+}
+
+# Characters allowed in a formula once fields and function names are removed
+_ALLOWED_CHARS = frozenset('0123456789+-*/.(), ')
+
+# Function names allowed in formulas
+_ALLOWED_FUNCTION_NAMES = frozenset(name for name in _SAFE_GLOBALS if name != "__builtins__")
+
+# AST node types allowed in a translated formula: arithmetic on numbers, fields and function calls
+_ALLOWED_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Name, ast.Load, ast.Constant,
+                  ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Pow, ast.UAdd, ast.USub)
+
+# Largest exponent allowed with "**" or POW - the exponent must be a number,
+# so a formula cannot build an unbounded power tower like 9**9**9**9
+_MAX_EXPONENT = 100
+
+# Field parameter names in a translated formula
+_PARAMETER_RE = re.compile(r'_f\d+')
+
+# All allowed function names, stripped in one pass during validation
+_ALL_FUNCS_RE = re.compile(r'\b(?:' + '|'.join(map(re.escape, sorted(_ALLOWED_FUNCTION_NAMES))) + r')\b', re.IGNORECASE)
+
+@functools.lru_cache(maxsize=256)
+def _extract_fields(formula: str) -> Tuple[str, ...]:
+    """Unique field names referenced in a formula, in order of first appearance"""
+    return tuple(dict.fromkeys(_FIELD_RE.findall(formula)))
+
+def _normalize_definition(doc: Dict) -> Dict:
+    """Ledger definition with every _LEDGER_DEFAULTS field present and a string _id"""
+    return {**{key: doc.get(key, default) for key, default in _LEDGER_DEFAULTS.items()}, '_id': str(doc.get('_id', ''))}
+
+@functools.lru_cache(maxsize=256)
+def _compile_ledger_template(ledger_definition: str) -> Tuple[Tuple[str, Optional[str]], ...]:
+    """Ledger definition split once into (literal, field) pairs; the last pair's field is None"""
+    parts = _FIELD_RE.split(ledger_definition)
+    return tuple(zip(parts[::2], parts[1::2] + [None]))
+
+def _translate_formula(formula: str) -> Optional[str]:
+    """Python expression for a formula with fields bound to _f0, _f1, ..., or None if unsafe"""
+    # Safety check - remove field references and function names and check remaining characters
+    validation_expr = _ALL_FUNCS_RE.sub('', _FIELD_RE.sub('0', formula))
+    
+    if not _ALLOWED_CHARS.issuperset(validation_expr):
+        print(f"Warning: Unsafe expression detected: {formula}")
+        print(f"Validation expression: {validation_expr}")
+        return None
+    
+    parameters = {field: f"_f{i}" for i, field in enumerate(_extract_fields(formula))}
+    expression = _FIELD_RE.sub(lambda m: parameters[m.group(1)], formula)
+    return _FUNC_RE.sub(lambda m: f"{m.group(1).lower()}(", expression)
+
+def _is_constant_exponent(node: ast.AST) -> bool:
+    """True if node is a number (optionally signed) no larger than _MAX_EXPONENT"""
+    while isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        node = node.operand
+    return (isinstance(node, ast.Constant) and isinstance(node.value, (int, float))
+            and not isinstance(node.value, bool) and abs(node.value) <= _MAX_EXPONENT)
+
+def _is_safe_expression(tree: ast.Expression) -> bool:
+    """True if a parsed formula only uses arithmetic, numbers, fields and allowed function calls"""
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            return False
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Pow) and not _is_constant_exponent(node.right):
+            return False
+        if isinstance(node, ast.Call) and (not isinstance(node.func, ast.Name) or node.keywords
+                                           or node.func.id not in _ALLOWED_FUNCTION_NAMES):
+            return False
+        if isinstance(node, ast.Call) and node.func.id == 'pow' and (len(node.args) != 2
+                                                                   or not _is_constant_exponent(node.args[1])):
+            return False
+        if isinstance(node, ast.Name) and not (node.id in _ALLOWED_FUNCTION_NAMES or _PARAMETER_RE.fullmatch(node.id)):
+            return False
+        if isinstance(node, ast.Constant) and (isinstance(node.value, bool) or not isinstance(node.value, (int, float))):
+            return False
+    return True
+
+@functools.lru_cache(maxsize=1024)
+def _compile_formula(formula: str, vectorized: bool = False) -> Tuple[Optional[Callable[..., Any]], Tuple[str, ...]]:
+    """
+    Formula compiled once per process into a lambda over its fields, with
+    function names resolved to NumPy equivalents when vectorized
+    """
+    fields = _extract_fields(formula)
+    function = None
+    
+    expression = _translate_formula(formula)
+    if expression is not None:
+        parameters = ', '.join(f"_f{i}" for i in range(len(fields)))
+        try:
+            # The character check cannot see structure (e.g. unbounded "**"
+            # exponents or tuples), so the parsed expression is checked node by node too
+            if not _is_safe_expression(ast.parse(expression, mode='eval')):
+                print(f"Warning: Unsafe expression detected: {formula}")
+                return None, fields
+            function = eval(compile(f"lambda {parameters}: {expression}", '<formula>', 'eval'),
+                            _NUMPY_GLOBALS if vectorized else _SAFE_GLOBALS)
+        except SyntaxError as e:
+            print(f"Error compiling formula '{formula}': {e}")
+    
+    return function, fields
+
+# Shared clients (and connection pools) keyed by connection settings, created on first use
+_clients = {}
+
+def get_client(host: str, username: str, password: str) -> MongoClient:
+    """
+    Return a MongoClient for the given settings, shared by every processor in
+    the process so each server is monitored and pooled only once
+    
+    Args:
+        host: MongoDB host
+        username: MongoDB username
+        password: MongoDB password
+        
+    Returns:
+        Shared MongoClient (connects lazily on first operation)
+    """
+    key = (host, username, password)
+    if key not in _clients:
+        # Credentials are passed separately so they need no URI escaping
+        client = MongoClient(host=host, port=27017, username=username, password=password,
+                             authSource='admin', maxPoolSize=32)
+        atexit.register(client.close)
+        _clients[key] = client
+    return _clients[key]
+
 class DynamicSubLedgerProcessor:
     """
     Processes dynamic sub-ledger definitions and generates ledger entries
@@ -27,26 +279,48 @@ class DynamicSubLedgerProcessor:
     
     def __init__(self, mongodb_container: str = "financial_data_mongodb", 
                  collection_name: str = "derivedSubLedgerRollup",
-                 db_name: str = "financial_data"):
+                 db_name: str = "financial_data",
+                 max_workers: int = 8,
+                 rules: Optional[List[Dict]] = None):
         """
         Initialize the processor
         
         Args:
-            mongodb_container: Name of the MongoDB Docker container
+            mongodb_container: Name of the MongoDB Docker container (kept for reference only)
             collection_name: Name of the MongoDB collection containing ledger definitions
             db_name: Name of the MongoDB database
+            max_workers: Number of rule groups to aggregate concurrently
+            rules: Optional ledger definitions to process instead of reading
+                them from the MongoDB collection
         """
         self.mongodb_container = mongodb_container
         self.collection_name = collection_name
         self.db_name = db_name
+        self.max_workers = max_workers
         
         # Get credentials from environment variables
         self.db_username = os.getenv('MONGO_USERNAME', 'admin')
         self.db_password = os.getenv('MONGO_PASSWORD', 'password123')
+        self.db_host = os.getenv('MONGO_HOST', 'localhost')
+        
+        # Persistent driver connection, shared with other processors using the same settings
+        self.client = get_client(self.db_host, self.db_username, self.db_password)
+        self.db = self.client[db_name]
         
-        self.ledger_definitions = []
+        self.ledger_definitions = [_normalize_definition(rule) for rule in rules or ()]
         self.results = []
         
+        # Running summary of generated entries, keyed by ledger account
+        self._ledger_summary = {}
+        self._entry_type_counts = {'total': 0, 'static': 0, 'dynamic': 0}
+        
+        # Numba-compiled formulas keyed by formula string
+        self._jit_cache = {}
+        self._formula_row_counts = {}
+        
+        # Output collections whose unique ledger entry index has been ensured
+        self._indexed_outputs = set()
+        
     def read_ledger_definitions_from_mongodb(self) -> List[Dict]:
         """
         Read ledger definitions from MongoDB collection
@@ -55,44 +329,11 @@ class DynamicSubLedgerProcessor:
             List of dictionaries containing ledger definitions
         """
         try:
-            # Query the MongoDB collection
-            cmd = [
-                "docker", "exec", self.mongodb_container,
-                "mongosh", "-u", self.db_username, "-p", self.db_password,
-                "--authenticationDatabase", "admin", self.db_name,
-                "--eval", f"""
-                db.{self.collection_name}.find({{status: 'active'}}).forEach(function(doc) {{
-                    print(JSON.stringify(doc));
-                }});
-                """,
-                "--quiet"
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode != 0:
-                print(f"MongoDB query error: {result.stderr}")
-                return []
+            projection = dict.fromkeys(_LEDGER_DEFAULTS, 1)
+            cursor = self.db[self.collection_name].find({'status': 'active'}, projection=projection)
             
-            # Parse the JSON results
-            ledger_definitions = []
-            for line in result.stdout.strip().split('\n'):
-                if line.strip():
-                    try:
-                        doc = json.loads(line)
-                        # Remove MongoDB-specific fields and convert to expected format
-                        cleaned_doc = {
-                            'ruleName': doc.get('ruleName', ''),
-                            'sourceTable': doc.get('sourceTable', ''),
-                            'ledgerDefinition': doc.get('ledgerDefinition', ''),
-                            'dataDefinition': doc.get('dataDefinition', ''),
-                            'filter': doc.get('filter', ''),
-                            'status': doc.get('status', 'active'),
-                            '_id': str(doc.get('_id', ''))
-                        }
-                        ledger_definitions.append(cleaned_doc)
-                    except json.JSONDecodeError:
-                        continue
+            # Convert to expected format
+            ledger_definitions = [_normalize_definition(doc) for doc in cursor]
             
             self.ledger_definitions = ledger_definitions
             print(f"Read {len(ledger_definitions)} ledger definitions from MongoDB collection '{self.collection_name}'")
@@ -112,19 +353,28 @@ class DynamicSubLedgerProcessor:
         Returns:
             List of field names found in the formula
         """
-        # Pattern to match field names in square brackets
-        pattern = r'\[([^\]]+)\]'
-        matches = re.findall(pattern, formula)
+        return list(_extract_fields(formula))
+    
+    def resolve_ledger_account(self, ledger_definition: str, data: Dict) -> str:
+        """
+        Resolve a ledger account definition against a query result
         
-        # Remove duplicates while preserving order
-        fields = []
-        for field in matches:
-            if field not in fields:
-                fields.append(field)
-                
-        return fields
+        Each [field] reference is replaced by that field's value in the result
+        ('UNKNOWN' when missing) and surrounding text is kept, so
+        "300[categoryCode]001" resolves to "300200001" for categoryCode 200.
+        
+        Args:
+            ledger_definition: Static account or pattern with [field] references
+            data: Query result document
+            
+        Returns:
+            Resolved ledger account
+        """
+        return ''.join(literal if field is None else literal + str(data.get(field, 'UNKNOWN'))
+                       for literal, field in _compile_ledger_template(ledger_definition))
     
-    def build_mongodb_query(self, source_table: str, filter_condition: str, fields: List[str], ledger_field: str = None) -> str:
+    def build_mongodb_query(self, source_table: str, filter_condition: str, fields: List[str], ledger_field: str = None,
+                            formula: str = None) -> List[Dict]:
         """
         Build MongoDB aggregation query
         
@@ -133,9 +383,28 @@ class DynamicSubLedgerProcessor:
             filter_condition: Filter condition for the query
             fields: List of fields to select for calculations
             ledger_field: Optional ledger field name for dynamic lookup
+            formula: Optional formula to evaluate server-side into CALCULATED_VALUE_FIELD
             
         Returns:
-            MongoDB aggregation query as string
+            MongoDB aggregation pipeline as a list of stages
+        """
+        lookup_fields = [ledger_field] if ledger_field else []
+        calculations = {CALCULATED_VALUE_FIELD: formula} if formula else {}
+        return self.build_group_pipeline(filter_condition, fields, lookup_fields, calculations)
+    
+    def build_group_pipeline(self, filter_condition: str, fields: List[str], lookup_fields: List[str],
+                             calculations: Dict[str, str]) -> List[Dict]:
+        """
+        Build the aggregation pipeline shared by one or more rules
+        
+        Args:
+            filter_condition: Filter condition for the query
+            fields: Fields to sum per (valuationDt, account) group
+            lookup_fields: Ledger fields to look up (first value, not sum)
+            calculations: Output field name -> formula to evaluate server-side
+            
+        Returns:
+            MongoDB aggregation pipeline as a list of stages
         """
         # Base fields to always include
         base_fields = ['valuationDt', 'account']
@@ -146,36 +415,17 @@ class DynamicSubLedgerProcessor:
         # Add the fields from the formula
         all_fields = list(set(base_fields + fields))
         
-        # Add ledger field if it's a dynamic lookup (don't include in sum aggregation)
-        if ledger_field:
-            all_fields.append(ledger_field)
+        # Add ledger fields for dynamic lookups (don't include in sum aggregation)
+        all_fields.extend(lookup_fields)
         
-        # Build the projection
-        projection = {}
+        # Build the projection - excluding _id lets an index holding every
+        # projected field cover the query without fetching documents
+        projection = {'_id': 0}
         for field in all_fields:
             projection[field] = 1
         
         # Build the match stage
-        match_stage = {}
-        if filter_condition and filter_condition.lower() != 'none' and filter_condition.strip():
-            # Parse simple filter conditions
-            # For now, handle basic conditions like "shareClass='A'"
-            if '=' in filter_condition:
-                parts = filter_condition.split('=')
-                if len(parts) == 2:
-                    field_name = parts[0].strip()
-                    field_value = parts[1].strip().strip("'\"")
-                    
-                    # Handle boolean values
-                    if field_value.lower() == 'true':
-                        field_value = True
-                    elif field_value.lower() == 'false':
-                        field_value = False
-                    # Handle numeric values
-                    elif field_value.replace('.', '').isdigit():
-                        field_value = float(field_value) if '.' in field_value else int(field_value)
-                    
-                    match_stage[field_name] = field_value
+        match_stage = self.parse_filter(filter_condition)
         
         # Build aggregation pipeline
         pipeline = []
@@ -196,57 +446,280 @@ class DynamicSubLedgerProcessor:
         for field in fields:
             group_stage[field] = {"$sum": f"${field}"}
         
-        # Add ledger field as lookup (first value, not sum)
-        if ledger_field:
+        # Add ledger fields as lookups (first value, not sum)
+        for ledger_field in lookup_fields:
             group_stage[ledger_field] = {"$first": f"${ledger_field}"}
         
         pipeline.append({"$project": projection})
         pipeline.append({"$group": group_stage})
         
-        return json.dumps(pipeline, indent=2)
+        # Evaluate formulas over the grouped sums when they have a server-side equivalent
+        calculated_fields = {}
+        for output_field, formula in calculations.items():
+            expression = self.build_formula_expression(formula)
+            if expression is not None:
+                calculated_fields[output_field] = expression
+        if calculated_fields:
+            pipeline.append({"$addFields": calculated_fields})
+        
+        return pipeline
+    
+    def parse_filter(self, filter_condition: str) -> Dict:
+        """
+        Parse a rule filter into a MongoDB query document
+        
+        Conditions compare a field to a value (=, ==, !=, <>, >, >=, <, <=) and
+        are joined with AND/OR, AND binding tighter. Quoted values are strings;
+        unquoted true/false and numbers are converted, and other unquoted
+        values (which may contain spaces) are strings. The filter is tokenized
+        in a single pass.
+        
+        Args:
+            filter_condition: Filter like "shareClass='A' AND isComposite=true"
+            
+        Returns:
+            MongoDB query document, empty if there is no filter
+            
+        Raises:
+            ValueError: If the filter cannot be parsed
+        """
+        if not filter_condition or not filter_condition.strip() or filter_condition.strip().lower() == 'none':
+            return {}
+        
+        # OR-separated groups of AND-ed conditions
+        groups = [[]]
+        expect_condition = True
+        position = 0
+        while position < len(filter_condition):
+            token = _FILTER_TOKEN_RE.match(filter_condition, position)
+            if token is None or expect_condition == bool(token.group('connector')):
+                raise ValueError(f"Unable to parse filter: {filter_condition}")
+            position = token.end()
+            
+            connector = token.group('connector')
+            if connector:
+                if connector.upper() == 'OR':
+                    groups.append([])
+            else:
+                value = token.group('value')
+                if value[0] in '\'"':
+                    value = value[1:-1]
+                elif value.lower() in _BOOL_VALUES:
+                    value = _BOOL_VALUES[value.lower()]
+                elif _NUM_RE.fullmatch(value):
+                    value = float(value) if '.' in value else int(value)
+                
+                operator = _FILTER_OPERATORS[token.group('op')]
+                groups[-1].append((token.group('field'), value if operator is None else {operator: value}))
+            expect_condition = bool(connector)
+        
+        if expect_condition:
+            raise ValueError(f"Unable to parse filter: {filter_condition}")
+        
+        clauses = []
+        for conditions in groups:
+            if len({field for field, _ in conditions}) == len(conditions):
+                clauses.append(dict(conditions))
+            else:
+                clauses.append({'$and': [{field: value} for field, value in conditions]})
+        
+        return clauses[0] if len(clauses) == 1 else {'$or': clauses}
     
-    def execute_mongodb_query(self, source_table: str, pipeline: str) -> List[Dict]:
+    def execute_mongodb_query(self, source_table: str, pipeline: List[Dict]) -> Iterator[Dict]:
         """
         Execute MongoDB aggregation query
         
         Args:
             source_table: Name of the collection
-            pipeline: MongoDB aggregation pipeline as JSON string
+            pipeline: MongoDB aggregation pipeline
             
         Returns:
-            List of query results
+            Cursor over the query results, fetched lazily in batches
         """
         try:
-            # Create the mongosh command
-            cmd = [
-                "docker", "exec", self.mongodb_container,
-                "mongosh", "-u", self.db_username, "-p", self.db_password,
-                "--authenticationDatabase", "admin", self.db_name,
-                "--eval", f"db.{source_table}.aggregate({pipeline}).forEach(function(doc) {{ print(JSON.stringify(doc)); }});",
-                "--quiet"
-            ]
+            return self.db[source_table].aggregate(pipeline, allowDiskUse=True, batchSize=1000)
+            
+        except Exception as e:
+            print(f"Error executing MongoDB query: {e}")
+            return iter(())
+    
+    def translate_formula(self, formula: str) -> Optional[str]:
+        """
+        Translate a formula into a Python expression string
+        
+        Field references become positional parameters `_f0`, `_f1`, ... in the
+        order returned by extract_fields_from_formula, and function names are
+        mapped to their Python equivalents.
+        
+        Args:
+            formula: Formula string like "ABS([bookValueBase])*-1"
             
-            result = subprocess.run(cmd, capture_output=True, text=True)
+        Returns:
+            Python expression string, or None if the formula is unsafe
+        """
+        return _translate_formula(formula)
+    
+    def compile_formula(self, formula: str) -> Tuple[Optional[Callable[..., Any]], Tuple[str, ...]]:
+        """
+        Compile a formula into a Python function, once per formula string
+        (shared by all processor instances)
+        
+        The function takes one positional argument per field, in the order
+        of the returned field list.
+        
+        Args:
+            formula: Formula string like "ABS([bookValueBase])*-1"
             
-            if result.returncode != 0:
-                print(f"MongoDB query error: {result.stderr}")
-                return []
+        Returns:
+            Tuple of (function or None if the formula is unsafe, field names)
+        """
+        return _compile_formula(formula)
+    
+    def compile_vector_formula(self, formula: str) -> Tuple[Optional[Callable[..., Any]], Tuple[str, ...]]:
+        """
+        Compile a formula into a function over NumPy field columns, once per formula string
+        
+        Args:
+            formula: Formula string like "ABS([bookValueBase])*-1"
             
-            # Parse the JSON results
-            results = []
-            for line in result.stdout.strip().split('\n'):
-                if line.strip():
-                    try:
-                        doc = json.loads(line)
-                        results.append(doc)
-                    except json.JSONDecodeError:
-                        continue
+        Returns:
+            Tuple of (function or None if the formula is unsafe, field names)
+        """
+        return _compile_formula(formula, vectorized=True)
+    
+    def jit_formula(self, formula: str) -> Optional[Callable[..., Any]]:
+        """
+        Compile a vectorized formula to native code with Numba, once per formula string
+        
+        Args:
+            formula: Formula string like "ABS([bookValueBase])*-1"
             
-            return results
+        Returns:
+            Compiled function over float64 columns, or None if Numba is not
+            installed or cannot compile the formula (e.g. MAX/MIN)
+        """
+        if formula in self._jit_cache:
+            return self._jit_cache[formula]
+        
+        function, fields = self.compile_vector_formula(formula)
+        jitted = None
+        if numba is not None and function is not None and fields:
+            try:
+                # Eager compilation for contiguous float64 columns; numpy error
+                # model so division by zero yields inf/nan instead of raising
+                signature = (numba.float64[::1],) * len(fields)
+                jitted = numba.njit([signature], error_model='numpy')(function)
+            except Exception as e:
+                print(f"Formula '{formula}' not compiled with Numba: {type(e).__name__}")
+        
+        self._jit_cache[formula] = jitted
+        return jitted
+    
+    def build_formula_expression(self, formula: str) -> Optional[Any]:
+        """
+        Translate a formula into a MongoDB aggregation expression
+        
+        The expression is evaluated after the $group stage, so field references
+        point at the grouped sums - the same values apply_formula receives.
+        Inputs Python rejects (division by zero, SQRT/LOG outside their domain,
+        EXP overflow, ...) make the whole formula evaluate to 0.0, as in
+        apply_formula.
+        
+        Args:
+            formula: Formula string like "ABS([bookValueBase])*-1"
             
-        except Exception as e:
-            print(f"Error executing MongoDB query: {e}")
-            return []
+        Returns:
+            Aggregation expression, or None if the formula must be evaluated in Python
+        """
+        function, fields = self.compile_formula(formula)
+        if function is None or any(field.startswith(CALCULATED_VALUE_FIELD) for field in fields):
+            return None
+        if any(field.startswith('$') or '.' in field for field in fields):
+            return None
+        
+        tree = ast.parse(self.translate_formula(formula), mode='eval')
+        
+        # Conditions under which Python raises, returning 0.0 for the whole
+        # formula. Inner conditions come first so $or short-circuits before
+        # evaluating an outer condition that would fail on the server.
+        guards = []
+        
+        def translate(node):
+            if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+                return node.value
+            if isinstance(node, ast.Name) and node.id.startswith('_f'):
+                return f"${fields[int(node.id[2:])]}"
+            if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+                operand = translate(node.operand)
+                if isinstance(node.op, ast.UAdd):
+                    return operand
+                if isinstance(operand, (int, float)):
+                    return -operand
+                return {"$multiply": [-1, operand]}
+            if isinstance(node, ast.BinOp):
+                left, right = translate(node.left), translate(node.right)
+                if isinstance(node.op, ast.Add):
+                    return {"$add": [left, right]}
+                if isinstance(node.op, ast.Sub):
+                    return {"$subtract": [left, right]}
+                if isinstance(node.op, ast.Mult):
+                    return {"$multiply": [left, right]}
+                if isinstance(node.op, ast.Div):
+                    guards.append({"$eq": [right, 0]})
+                    return {"$divide": [left, right]}
+                raise ValueError("unsupported operator")
+            if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+                args = [translate(arg) for arg in node.args]
+                name = node.func.id
+                if name in ('abs', 'ceil', 'floor') and len(args) == 1:
+                    return {f"${name}": args[0]}
+                if name == 'round' and len(args) in (1, 2):
+                    places = args[1] if len(args) == 2 else 0
+                    # The server rejects places outside its range, failing the
+                    # whole aggregation, so those stay in Python
+                    if isinstance(places, int) and MIN_ROUND_PLACES <= places <= MAX_ROUND_PLACES:
+                        return {"$round": [args[0], places]}
+                if name in ('max', 'min') and len(args) >= 2:
+                    return {f"${name}": args}
+                if name in ('sin', 'cos', 'tan') and len(args) == 1:
+                    return {f"${name}": args[0]}
+                if name == 'sqrt' and len(args) == 1:
+                    guards.append({"$lt": [args[0], 0]})
+                    return {"$sqrt": args[0]}
+                if name == 'exp' and len(args) == 1:
+                    guards.append({"$gt": [args[0], MAX_EXP_ARGUMENT]})
+                    return {"$exp": args[0]}
+                if name == 'log10' and len(args) == 1:
+                    guards.append({"$lte": [args[0], 0]})
+                    return {"$log10": args[0]}
+                if name == 'log' and len(args) == 1:
+                    guards.append({"$lte": [args[0], 0]})
+                    return {"$ln": args[0]}
+                if name == 'log' and len(args) == 2:
+                    # $log only accepts bases above 1 and fails the whole
+                    # aggregation otherwise, so compute ln(x) / ln(base) as
+                    # math.log does, which also covers bases in (0, 1)
+                    guards.append({"$lte": [args[0], 0]})
+                    guards.append({"$lte": [args[1], 0]})
+                    guards.append({"$eq": [args[1], 1]})
+                    return {"$divide": [{"$ln": args[0]}, {"$ln": args[1]}]}
+                if name == 'pow' and len(args) == 2:
+                    base, exponent = args
+                    # 0 to a negative power, or a negative base to a fractional
+                    # power (a complex result in Python)
+                    guards.append({"$and": [{"$eq": [base, 0]}, {"$lt": [exponent, 0]}]})
+                    guards.append({"$and": [{"$lt": [base, 0]}, {"$ne": [exponent, {"$trunc": [exponent]}]}]})
+                    return {"$pow": args}
+            raise ValueError("unsupported expression")
+        
+        try:
+            expression = translate(tree.body)
+        except ValueError:
+            return None
+        
+        if guards:
+            expression = {"$cond": [{"$or": guards}, 0.0, expression]}
+        return expression
     
     def apply_formula(self, formula: str, data: Dict) -> float:
         """
@@ -262,101 +735,84 @@ class DynamicSubLedgerProcessor:
             Calculated result
         """
         try:
-            # Replace field references with actual values
-            expression = formula
-            
-            # Extract fields from formula
-            fields = self.extract_fields_from_formula(formula)
+            function, fields = self.compile_formula(formula)
+            if function is None:
+                return 0.0
             
-            # Replace field references with actual values
+            # Bind field values, treating missing values as 0
+            values = []
             for field in fields:
                 field_value = data.get(field, 0)
-                if field_value is None:
-                    field_value = 0
-                
-                # Replace [fieldName] with the actual value
-                expression = expression.replace(f'[{field}]', str(field_value))
-            
-            # Define safe mathematical functions
-            import math
-            safe_functions = {
-                'ABS': abs,
-                'ROUND': round,
-                'MAX': max,
-                'MIN': min,
-                'CEIL': math.ceil,
-                'FLOOR': math.floor,
-                'SQRT': math.sqrt,
-                'POW': pow,
-                'LOG': math.log,
-                'LOG10': math.log10,
-                'EXP': math.exp,
-                'SIN': math.sin,
-                'COS': math.cos,
-                'TAN': math.tan
-            }
-            
-            # Replace function calls with Python equivalents
-            for func_name, func in safe_functions.items():
-                # Handle function calls like ABS(value) -> abs(value)
-                pattern = rf'\b{func_name}\s*\('
-                expression = re.sub(pattern, f'{func.__name__}(', expression, flags=re.IGNORECASE)
-            
-            # Create a safe evaluation environment
-            safe_dict = {
-                "__builtins__": {},
-                **{func.__name__: func for func in safe_functions.values()}
-            }
+                values.append(0 if field_value is None else field_value)
             
-            # Additional safety check - remove function names and check remaining characters
-            allowed_chars = set('0123456789+-*/.(), ')
-            allowed_function_names = set(func.__name__ for func in safe_functions.values())
-            
-            # Create a version of the expression without function names for validation
-            validation_expr = expression
-            for func_name in allowed_function_names:
-                validation_expr = re.sub(rf'\b{func_name}\b', '', validation_expr, flags=re.IGNORECASE)
-            
-            # Check if remaining characters are safe
-            if all(c in allowed_chars for c in validation_expr):
-                # Evaluate the mathematical expression safely
-                result = eval(expression, safe_dict, {})
-                return float(result)
-            else:
-                print(f"Warning: Unsafe expression detected: {expression}")
-                print(f"Validation expression: {validation_expr}")
-                return 0.0
+            return float(function(*values))
                 
         except Exception as e:
             print(f"Error applying formula '{formula}': {e}")
             return 0.0
     
-    def process_ledger_definition(self, definition: Dict) -> List[Dict]:
+    def apply_formula_batch(self, formula: str, rows: List[Dict]) -> List[float]:
         """
-        Process a single ledger definition
+        Apply a formula to many rows at once using NumPy column arithmetic
+        
+        Results match apply_formula row by row: missing values count as 0,
+        and rows where the formula is undefined (division by zero, domain
+        errors) evaluate to 0.0. Falls back to apply_formula if the field
+        values are not numeric. Formulas applied to more than
+        JIT_THRESHOLD_ROWS rows are compiled with Numba when it is installed.
+        
+        Args:
+            formula: Formula string like "ABS([bookValueBase])*-1"
+            rows: Dictionaries containing field values
+            
+        Returns:
+            Calculated results, one per row
+        """
+        function, fields = self.compile_vector_formula(formula)
+        if function is None:
+            return [0.0] * len(rows)
+        
+        # Switch hot formulas to native code once they have seen enough rows
+        row_count = self._formula_row_counts.get(formula, 0) + len(rows)
+        self._formula_row_counts[formula] = row_count
+        if row_count >= JIT_THRESHOLD_ROWS:
+            function = self.jit_formula(formula) or function
+        
+        try:
+            columns = [
+                np.fromiter((0 if row.get(field) is None else row[field] for row in rows),
+                            dtype=np.float64, count=len(rows))
+                for field in fields
+            ]
+            with np.errstate(all='ignore'):
+                values = np.broadcast_to(np.asarray(function(*columns), dtype=np.float64), (len(rows),))
+            return np.where(np.isfinite(values), values, 0.0).tolist()
+        
+        except Exception:
+            return [self.apply_formula(formula, row) for row in rows]
+    
+    def prepare_rule(self, definition: Dict) -> Dict:
+        """
+        Parse a ledger definition into the values needed to process it
         
         Args:
             definition: Single ledger definition from MongoDB collection
             
         Returns:
-            List of ledger entries
+            Dictionary describing the rule
         """
         print(f"\nProcessing rule: {definition.get('ruleName', 'Unknown')}")
         
-        source_table = definition.get('sourceTable', '').strip()
-        data_definition = definition.get('dataDefinition', '').strip()
         ledger_definition = definition.get('ledgerDefinition', '').strip()
-        filter_condition = definition.get('filter', '').strip()
+        data_definition = definition.get('dataDefinition', '').strip()
         
-        # Check if ledger definition is a dynamic lookup (contains square brackets)
-        ledger_field = None
-        is_dynamic_ledger = False
+        # The ledger account is dynamic if it references fields, either alone
+        # ("[accountCode]") or embedded in a template ("300[categoryCode]001")
+        ledger_fields = list(_extract_fields(ledger_definition))
+        is_dynamic_ledger = bool(ledger_fields)
         
-        if ledger_definition.startswith('[') and ledger_definition.endswith(']'):
-            # Extract field name from [fieldName]
-            ledger_field = ledger_definition[1:-1]  # Remove brackets
-            is_dynamic_ledger = True
-            print(f"Dynamic ledger account lookup detected: {ledger_field}")
+        if is_dynamic_ledger:
+            print(f"Dynamic ledger account lookup detected: {', '.join(ledger_fields)}")
         else:
             print(f"Static ledger account: {ledger_definition}")
         
@@ -364,119 +820,441 @@ class DynamicSubLedgerProcessor:
         fields = self.extract_fields_from_formula(data_definition)
         print(f"Fields extracted from formula: {fields}")
         
-        # Build and execute MongoDB query
-        pipeline = self.build_mongodb_query(source_table, filter_condition, fields, ledger_field)
-        print(f"MongoDB pipeline: {pipeline}")
+        source_keys = list(dict.fromkeys(['_id', 'eagleEntityId'] + fields + ledger_fields))
         
-        query_results = self.execute_mongodb_query(source_table, pipeline)
-        print(f"Query returned {len(query_results)} results")
+        return {
+            'ruleName': definition.get('ruleName', ''),
+            'sourceTable': definition.get('sourceTable', '').strip(),
+            'filter': definition.get('filter', '').strip(),
+            'ledgerDefinition': ledger_definition,
+            'dataDefinition': data_definition,
+            'ledgerFields': ledger_fields,
+            'isDynamicLedger': is_dynamic_ledger,
+            'fields': fields,
+            'sourceKeys': source_keys
+        }
+    
+    def ensure_indexes(self, definitions: Optional[List[Dict]] = None) -> List[str]:
+        """
+        Create an index on each source table matching its rules' filter and grouping
+        
+        Keys follow Equality-Sort-Range order: equality filter fields, then
+        the (valuationDt, account) group keys, then range filter fields, so
+        the $match and $group of each rule group can use an index scan.
+        Filters with OR branches are skipped. Existing indexes are left as is.
+        
+        Args:
+            definitions: Ledger definitions (defaults to the loaded definitions)
+            
+        Returns:
+            Names of the indexes ensured
+        """
+        if definitions is None:
+            definitions = self.ledger_definitions or self.read_ledger_definitions_from_mongodb()
         
-        # Apply formula to each result
-        ledger_entries = []
-        for result in query_results:
+        index_names = []
+        ensured = set()
+        for source_table, filter_condition in self.group_definitions(definitions):
             try:
-                # Extract the grouped data
-                valuation_dt = result['_id']['valuationDt']
-                account = result['_id']['account']
-                eagle_entity_id = result.get('eagleEntityId', '')
-                
-                # Determine the ledger account
-                if is_dynamic_ledger:
-                    # Use the value from the lookup field
-                    dynamic_ledger_account = result.get(ledger_field, 'UNKNOWN')
-                    final_ledger_account = str(dynamic_ledger_account)
-                    print(f"Dynamic ledger account for {account}: {final_ledger_account}")
-                else:
-                    # Use the static value
-                    final_ledger_account = ledger_definition
-                
-                # Apply the formula
-                calculated_value = self.apply_formula(data_definition, result)
-                
-                # Create ledger entry
-                ledger_entry = {
-                    'ruleName': definition.get('ruleName', ''),
-                    'valuationDt': valuation_dt,
-                    'account': account,
-                    'eagleLedgerAcct': final_ledger_account,
-                    'eagleEntityId': eagle_entity_id,
-                    'calculatedValue': calculated_value,
-                    'dataDefinition': data_definition,
-                    'ledgerDefinitionType': 'dynamic' if is_dynamic_ledger else 'static',
-                    'ledgerSourceField': ledger_field if is_dynamic_ledger else None,
-                    'sourceData': result,
-                    'processedAt': datetime.now().isoformat()
-                }
-                
-                ledger_entries.append(ledger_entry)
-                
-            except Exception as e:
-                print(f"Error processing result: {e}")
+                match = self.parse_filter(filter_condition)
+            except ValueError as e:
+                print(f"Skipping index for {source_table}: {e}")
+                continue
+            if any(field.startswith('$') for field in match):
                 continue
+            
+            equality_fields = [field for field, value in match.items() if not isinstance(value, dict)]
+            range_fields = [field for field, value in match.items() if isinstance(value, dict)]
+            keys = tuple(dict.fromkeys(equality_fields + ['valuationDt', 'account'] + range_fields))
+            if (source_table, keys) in ensured:
+                continue
+            ensured.add((source_table, keys))
+            
+            try:
+                index_names.append(self.db[source_table].create_index([(field, 1) for field in keys], background=True))
+                print(f"Ensured index on {source_table}: {', '.join(keys)}")
+            except Exception as e:
+                print(f"Error creating index on {source_table}: {e}")
+        
+        return index_names
+    
+    def group_definitions(self, definitions: List[Dict]) -> Dict[Tuple[str, str], List[Dict]]:
+        """
+        Group ledger definitions that read the same source table with the same filter
+        
+        Args:
+            definitions: Ledger definitions
+            
+        Returns:
+            Dictionary of (sourceTable, filter) -> definitions, in first-seen order
+        """
+        groups = {}
+        for definition in definitions:
+            filter_condition = definition.get('filter', '').strip()
+            if filter_condition.lower() == 'none':
+                filter_condition = ''
+            key = (definition.get('sourceTable', '').strip(), filter_condition)
+            groups.setdefault(key, []).append(definition)
+        return groups
+    
+    def prepare_rule_group(self, definitions: List[Dict]) -> Dict:
+        """
+        Build the shared aggregation for ledger definitions with the same source table and filter
+        
+        The $group stage sums the union of all the rules' formula fields, and
+        each rule's formula is evaluated into its own calculated field.
         
-        print(f"Generated {len(ledger_entries)} ledger entries")
-        return ledger_entries
+        Args:
+            definitions: Ledger definitions with the same sourceTable and filter
+            
+        Returns:
+            Dictionary with the prepared rules, source table, calculated
+            field names and aggregation pipeline
+            
+        Raises:
+            ValueError: If the group's filter cannot be parsed
+        """
+        rules = [self.prepare_rule(definition) for definition in definitions]
+        source_table = rules[0]['sourceTable']
+        filter_condition = rules[0]['filter']
+        
+        fields = list(dict.fromkeys(field for rule in rules for field in rule['fields']))
+        lookup_fields = list(dict.fromkeys(field for rule in rules for field in rule['ledgerFields']))
+        calculations = {
+            f"{CALCULATED_VALUE_FIELD}_{index}": rule['dataDefinition'] for index, rule in enumerate(rules)
+        }
+        
+        # Build MongoDB query
+        pipeline = self.build_group_pipeline(filter_condition, fields, lookup_fields, calculations)
+        print(f"MongoDB pipeline: {orjson.dumps(pipeline, option=orjson.OPT_INDENT_2).decode()}")
+        
+        return {
+            'rules': rules,
+            'sourceTable': source_table,
+            'calculations': calculations,
+            'pipeline': pipeline
+        }
+    
+    def process_rule_group(self, definitions: List[Dict]) -> Iterator[Dict]:
+        """
+        Process ledger definitions sharing a source table and filter with one aggregation
+        
+        Args:
+            definitions: Ledger definitions with the same sourceTable and filter
+            
+        Yields:
+            Ledger entries, as the query results are streamed from the cursor
+        """
+        try:
+            group = self.prepare_rule_group(definitions)
+        except ValueError as e:
+            # Never fall back to an unfiltered query, which would match every document
+            print(f"Skipping rules {[d.get('ruleName', '') for d in definitions]}: {e}")
+            return
+        query_results = self.execute_mongodb_query(group['sourceTable'], group['pipeline'])
+        yield from self.generate_ledger_entries(group, query_results)
+    
+    def process_table_groups(self, groups: List[List[Dict]]) -> Iterator[Dict]:
+        """
+        Process rule groups that read the same source table with one $facet aggregation
+        
+        The collection is scanned once and each group's pipeline runs as a
+        facet. Facet output is returned as a single document, so if it fails
+        (e.g. over the 16MB document limit) each group is aggregated on its own.
+        
+        Args:
+            groups: Lists of ledger definitions, one per (sourceTable, filter) group
+            
+        Yields:
+            Ledger entries
+        """
+        if len(groups) == 1:
+            yield from self.process_rule_group(groups[0])
+            return
+        
+        prepared = []
+        for definitions in groups:
+            try:
+                prepared.append(self.prepare_rule_group(definitions))
+            except ValueError as e:
+                print(f"Skipping rules {[d.get('ruleName', '') for d in definitions]}: {e}")
+        if not prepared:
+            return
+        
+        source_table = prepared[0]['sourceTable']
+        facets = {f"group_{index}": group['pipeline'] for index, group in enumerate(prepared)}
+        
+        try:
+            facet_results = next(self.db[source_table].aggregate([{"$facet": facets}], allowDiskUse=True))
+        except OperationFailure as e:
+            print(f"$facet aggregation on {source_table} failed, running groups separately: {e}")
+            for group in prepared:
+                query_results = self.execute_mongodb_query(source_table, group['pipeline'])
+                yield from self.generate_ledger_entries(group, query_results)
+            return
+        
+        for index, group in enumerate(prepared):
+            yield from self.generate_ledger_entries(group, facet_results.pop(f"group_{index}"))
     
-    def process_all_definitions(self) -> List[Dict]:
+    def generate_ledger_entries(self, group: Dict, query_results: Iterable[Dict]) -> Iterator[Dict]:
+        """
+        Generate ledger entries for a prepared rule group from its query results
+        
+        Args:
+            group: Rule group from prepare_rule_group
+            query_results: Grouped query results
+            
+        Yields:
+            Ledger entries
+        """
+        rules = group['rules']
+        calculations = group['calculations']
+        query_results = iter(query_results)
+        
+        # Rule-level values are filled in once; each entry copies its rule's
+        # template and sets the per-result fields
+        processed_at = datetime.now().isoformat()
+        templates = [
+            {
+                'ruleName': rule['ruleName'],
+                'valuationDt': None,
+                'account': None,
+                'eagleLedgerAcct': rule['ledgerDefinition'],
+                'eagleEntityId': None,
+                'calculatedValue': None,
+                'dataDefinition': rule['dataDefinition'],
+                'ledgerDefinitionType': 'dynamic' if rule['isDynamicLedger'] else 'static',
+                'ledgerSourceField': ', '.join(rule['ledgerFields']) if rule['isDynamicLedger'] else None,
+                'sourceData': None,
+                'processedAt': processed_at
+            }
+            for rule in rules
+        ]
+        
+        # Apply each rule's formula to each result, a batch of results at a time
+        result_count = 0
+        entry_counts = [0] * len(rules)
+        for batch in iter(lambda: list(islice(query_results, FORMULA_BATCH_SIZE)), []):
+            result_count += len(batch)
+            calculated = [{key: result.pop(key) for key in calculations if key in result} for result in batch]
+            
+            # Formulas the pipeline could not compute are evaluated column-wise
+            evaluated = {
+                index: self.apply_formula_batch(rule['dataDefinition'], batch)
+                for index, rule in enumerate(rules)
+                if any(f"{CALCULATED_VALUE_FIELD}_{index}" not in values for values in calculated)
+            }
+            
+            for position, result in enumerate(batch):
+                for index, rule in enumerate(rules):
+                    try:
+                        source_data = {key: result[key] for key in rule['sourceKeys'] if key in result}
+                        
+                        # Extract the grouped data
+                        valuation_dt = result['_id']['valuationDt']
+                        account = result['_id']['account']
+                        eagle_entity_id = result.get('eagleEntityId', '')
+                        
+                        # Use the server-side result when the pipeline computed it
+                        calculated_key = f"{CALCULATED_VALUE_FIELD}_{index}"
+                        if calculated_key in calculated[position]:
+                            calculated_value = float(calculated[position][calculated_key])
+                        else:
+                            calculated_value = evaluated[index][position]
+                        
+                        # Create ledger entry
+                        ledger_entry = templates[index].copy()
+                        ledger_entry['valuationDt'] = valuation_dt
+                        ledger_entry['account'] = account
+                        ledger_entry['eagleEntityId'] = eagle_entity_id
+                        ledger_entry['calculatedValue'] = calculated_value
+                        ledger_entry['sourceData'] = source_data
+                        
+                        # Fill the ledger account's [field] references from the result
+                        # (a static account resolves to itself)
+                        final_ledger_account = self.resolve_ledger_account(rule['ledgerDefinition'], result)
+                        ledger_entry['eagleLedgerAcct'] = final_ledger_account
+                        if rule['isDynamicLedger']:
+                            print(f"Dynamic ledger account for {account}: {final_ledger_account}")
+                        
+                        entry_counts[index] += 1
+                        yield ledger_entry
+                        
+                    except Exception as e:
+                        print(f"Error processing result: {e}")
+                        continue
+        
+        print(f"Query returned {result_count} results")
+        for rule, entry_count in zip(rules, entry_counts):
+            print(f"Generated {entry_count} ledger entries for rule: {rule['ruleName']}")
+    
+    def stream_entries(self, entries: Iterator[Dict], sink: queue.Queue, stop: threading.Event):
+        """
+        Feed generated ledger entries into a bounded queue, then mark the group done
+        
+        Args:
+            entries: Ledger entries of one rule group (or one source table)
+            sink: Queue consumed by process_all_definitions
+            stop: Set by the consumer to abandon the remaining entries
+        """
+        try:
+            for entry in entries:
+                if stop.is_set():
+                    break
+                sink.put(entry)
+        finally:
+            entries.close()
+            sink.put(_GROUP_DONE)
+    
+    def process_ledger_definition(self, definition: Dict) -> Iterator[Dict]:
+        """
+        Process a single ledger definition
+        
+        Args:
+            definition: Single ledger definition from MongoDB collection
+            
+        Yields:
+            Ledger entries, as the query results are streamed from the cursor
+        """
+        yield from self.process_rule_group([definition])
+    
+    def process_all_definitions(self, output_collection: Optional[str] = None,
+                                retain_results: bool = True, use_facet: bool = False,
+                                output_file: Optional[str] = None) -> List[Dict]:
         """
         Process all ledger definitions from the MongoDB collection
         
+        Rules sharing a source table and filter are processed with a single
+        aggregation, so the source data is scanned once per group. Groups
+        are aggregated concurrently on up to max_workers threads and handed
+        to the calling thread through a queue of ENTRY_QUEUE_SIZE entries, so
+        no group is held in memory as a whole.
+        
+        Args:
+            output_collection: Optional collection to upsert ledger entries into
+                as they are generated, in batches of OUTPUT_BATCH_SIZE
+            retain_results: Keep the generated entries in memory. Pass False
+                together with output_collection to stream large runs straight
+                to MongoDB without holding every entry.
+            use_facet: Run all groups on the same source table as one $facet
+                aggregation, scanning the collection once. Facets cannot use
+                indexes, so this pays off for unindexed or broad filters.
+            output_file: Optional JSON Lines file to write ledger entries to
+                as they are generated, one entry per line
+        
         Returns:
-            List of all generated ledger entries
+            List of all generated ledger entries (empty if not retained)
         """
         if not self.ledger_definitions:
             self.ledger_definitions = self.read_ledger_definitions_from_mongodb()
         
         all_ledger_entries = []
+        buffer = []
+        entries = queue.Queue(maxsize=ENTRY_QUEUE_SIZE)
+        stop = threading.Event()
+        self._ledger_summary = {}
+        self._entry_type_counts = {'total': 0, 'static': 0, 'dynamic': 0}
+        
+        groups = self.group_definitions(self.ledger_definitions)
         
-        for definition in self.ledger_definitions:
-            ledger_entries = self.process_ledger_definition(definition)
-            all_ledger_entries.extend(ledger_entries)
+        with open(output_file, 'wb') if output_file else contextlib.nullcontext() as jsonl, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            if use_facet:
+                tables = {}
+                for (source_table, _), definitions in groups.items():
+                    tables.setdefault(source_table, []).append(definitions)
+                producers = [self.process_table_groups(table_groups) for table_groups in tables.values()]
+            else:
+                producers = [self.process_rule_group(definitions) for definitions in groups.values()]
+            futures = [executor.submit(self.stream_entries, producer, entries, stop) for producer in producers]
+            
+            remaining = len(futures)
+            try:
+                while remaining:
+                    ledger_entry = entries.get()
+                    if ledger_entry is _GROUP_DONE:
+                        remaining -= 1
+                        continue
+                    
+                    self.update_summary(ledger_entry)
+                    if retain_results:
+                        all_ledger_entries.append(ledger_entry)
+                    
+                    if jsonl:
+                        jsonl.write(orjson.dumps(ledger_entry, default=str,
+                                                 option=_JSON_OPTIONS | orjson.OPT_APPEND_NEWLINE))
+                    
+                    if output_collection:
+                        buffer.append(ledger_entry)
+                        if len(buffer) >= OUTPUT_BATCH_SIZE:
+                            self.upsert_ledger_entries(output_collection, buffer)
+                            buffer.clear()
+            finally:
+                # If consuming failed, drain the queue so no thread stays blocked on it
+                stop.set()
+                while remaining:
+                    if entries.get() is _GROUP_DONE:
+                        remaining -= 1
+            
+            # Re-raise the first error from an aggregation thread
+            for future in futures:
+                future.result()
+        
+        if buffer:
+            self.upsert_ledger_entries(output_collection, buffer)
         
         self.results = all_ledger_entries
         return all_ledger_entries
     
+    def update_summary(self, entry: Dict):
+        """
+        Add a ledger entry to the running summary
+        
+        Args:
+            entry: Generated ledger entry
+        """
+        ledger_acct = entry.get('eagleLedgerAcct', 'Unknown')
+        ledger_type = entry.get('ledgerDefinitionType', 'unknown')
+        
+        self._entry_type_counts['total'] += 1
+        if ledger_type in ('dynamic', 'static'):
+            self._entry_type_counts[ledger_type] += 1
+        
+        summary = self._ledger_summary.get(ledger_acct)
+        if summary is None:
+            summary = self._ledger_summary[ledger_acct] = {
+                'count': 0,
+                'total_value': 0,
+                'rule_name': entry.get('ruleName', ''),
+                'type': ledger_type,
+                'source_field': entry.get('ledgerSourceField', '')
+            }
+        
+        summary['count'] += 1
+        summary['total_value'] += entry.get('calculatedValue', 0)
+    
     def generate_summary_report(self) -> str:
         """
         Generate a summary report of the processing results
         
+        The totals are accumulated as entries are generated, so this only
+        formats one line per ledger account.
+        
         Returns:
             Summary report as string
         """
-        if not self.results:
+        if not self._entry_type_counts['total']:
             return "No results to summarize"
         
-        # Group by ledger account
-        ledger_summary = {}
-        dynamic_count = 0
-        static_count = 0
-        
-        for entry in self.results:
-            ledger_acct = entry.get('eagleLedgerAcct', 'Unknown')
-            ledger_type = entry.get('ledgerDefinitionType', 'unknown')
-            
-            if ledger_type == 'dynamic':
-                dynamic_count += 1
-            elif ledger_type == 'static':
-                static_count += 1
-            
-            if ledger_acct not in ledger_summary:
-                ledger_summary[ledger_acct] = {
-                    'count': 0,
-                    'total_value': 0,
-                    'rule_name': entry.get('ruleName', ''),
-                    'type': ledger_type,
-                    'source_field': entry.get('ledgerSourceField', '')
-                }
-            
-            ledger_summary[ledger_acct]['count'] += 1
-            ledger_summary[ledger_acct]['total_value'] += entry.get('calculatedValue', 0)
+        ledger_summary = self._ledger_summary
+        dynamic_count = self._entry_type_counts['dynamic']
+        static_count = self._entry_type_counts['static']
         
         # Generate report
         report = f"\n{'='*80}\n"
         report += f"DYNAMIC SUB-LEDGER PROCESSING SUMMARY\n"
         report += f"{'='*80}\n"
-        report += f"Total Entries Generated: {len(self.results)}\n"
+        report += f"Total Entries Generated: {self._entry_type_counts['total']}\n"
         report += f"Static Ledger Accounts: {static_count}\n"
         report += f"Dynamic Ledger Accounts: {dynamic_count}\n"
         report += f"Processing Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
@@ -498,6 +1276,53 @@ class DynamicSubLedgerProcessor:
         
         return report
     
+    def upsert_ledger_entries(self, collection_name: str, entries: List[Dict]):
+        """
+        Upsert ledger entries keyed by (ruleName, valuationDt, account)
+        
+        The first write to a collection ensures a unique index on the key, so
+        each upsert finds its entry with an index lookup and concurrent runs
+        cannot insert the same entry twice.
+        
+        Args:
+            collection_name: Target collection name
+            entries: Ledger entries to write in one unordered bulk write
+        """
+        collection = self.db[collection_name]
+        if collection_name not in self._indexed_outputs:
+            collection.create_index([(field, 1) for field in LEDGER_ENTRY_KEY], unique=True, background=True)
+            self._indexed_outputs.add(collection_name)
+        
+        operations = [
+            UpdateOne({field: entry[field] for field in LEDGER_ENTRY_KEY}, {'$set': entry}, upsert=True)
+            for entry in entries
+        ]
+        collection.bulk_write(operations, ordered=False)
+    
+    def save_results_to_mongodb(self, collection_name: str = LEDGER_ENTRIES_COLLECTION) -> bool:
+        """
+        Save processing results to a MongoDB collection
+        
+        Re-running the processor updates existing entries instead of
+        duplicating them.
+        
+        Args:
+            collection_name: Target collection name
+            
+        Returns:
+            True if successful, False otherwise
+        """
+        try:
+            for start in range(0, len(self.results), OUTPUT_BATCH_SIZE):
+                self.upsert_ledger_entries(collection_name, self.results[start:start + OUTPUT_BATCH_SIZE])
+            
+            print(f"Results saved to collection '{collection_name}'")
+            return True
+            
+        except Exception as e:
+            print(f"Error saving results: {e}")
+            return False
+    
     def save_results_to_json(self, output_file: str) -> bool:
         """
         Save processing results to JSON file
@@ -509,8 +1334,8 @@ class DynamicSubLedgerProcessor:
             True if successful, False otherwise
         """
         try:
-            with open(output_file, 'w') as f:
-                json.dump(self.results, f, indent=2, default=str)
+            with open(output_file, 'wb') as f:
+                f.write(orjson.dumps(self.results, default=str, option=_JSON_OPTIONS))
             
             print(f"Results saved to {output_file}")
             return True
@@ -519,6 +1344,33 @@ class DynamicSubLedgerProcessor:
             print(f"Error saving results: {e}")
             return False
 
+    def process_and_stream_to_file(self, output_file: str) -> bool:
+        """
+        Run the processing, writing ledger entries to a JSON Lines file as they are generated
+        
+        This runs every aggregation itself (it is not an export of an earlier
+        run) and replaces self.results with an empty list: entries leave the
+        bounded queue in process_all_definitions straight for the file and
+        are not kept in memory, so memory stays flat however many entries a
+        run produces. The summary report is still available. To export the
+        results of a previous run, use save_results_to_json.
+        
+        Args:
+            output_file: Path to output JSON Lines file
+            
+        Returns:
+            True if successful, False otherwise
+        """
+        try:
+            self.process_all_definitions(retain_results=False, output_file=output_file)
+            
+            print(f"Results streamed to {output_file}")
+            return True
+            
+        except Exception as e:
+            print(f"Error processing results: {e}")
+            return False
+
 def main():
     """
     Main function to demonstrate the dynamic sub-ledger processing
@@ -530,6 +1382,9 @@ def main():
         collection_name="derivedSubLedgerRollup"
     )
     
+    # Make sure each rule group's filter and grouping can use an index
+    processor.ensure_indexes()
+    
     # Process all definitions
     results = processor.process_all_definitions()
     
@@ -538,8 +1393,7 @@ def main():
     print(summary)
     
     # Save results
-    output_file = "/Volumes/D/Ai/python/dataset/ledger_results.json"
-    processor.save_results_to_json(output_file)
+    processor.save_results_to_mongodb()
     
     # Display sample results
     if results:
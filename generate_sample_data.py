@@ -4,20 +4,45 @@ Script to generate sample dataNAV data structure and save as JSON
 This can be used to understand the data structure and import into MongoDB later
 """
 
-import json
-from faker import Faker
-import random
-from datetime import datetime, timedelta
 import uuid
+from datetime import date, datetime
+
+import numpy as np
+import orjson
+from faker import Faker
 
-# Initialize Faker for generating test data
+# Initialize Faker and the NumPy generator for generating test data
 fake = Faker()
+rng = np.random.default_rng()
+
+# Most distinct company names drawn from Faker per run
+COMPANY_POOL_SIZE = 100
+
+def _amounts(low, high, n, decimals=2):
+    """Draw n uniformly distributed amounts rounded to the given precision"""
+    return rng.uniform(low, high, n).round(decimals).tolist()
+
+def _ids(prefix, digits, n):
+    """Draw n random identifiers like ACC12345678"""
+    return [f"{prefix}{x}" for x in rng.integers(0, 10 ** digits, n).tolist()]
+
+def _flags(n):
+    """Draw n random booleans"""
+    return (rng.random(n) < 0.5).tolist()
+
+def _choices(options, n):
+    """Draw n values from a list of options"""
+    return rng.choice(options, n).tolist()
 
 def generate_sample_nav_data(num_records=20):
     """
     Generate sample data for dataNAV collection
+    
+    Every field is drawn as a whole column with NumPy and the records are
+    assembled by zipping the columns; Faker is only used for a small pool
+    of company names.
     """
-    data = []
+    n = num_records
     
     # Sample data pools
     share_classes = ['A', 'B', 'C', 'I', 'R', 'Z']
@@ -25,62 +50,75 @@ def generate_sample_nav_data(num_records=20):
     account_types = ['EQUITY', 'BOND', 'MIXED', 'MONEY_MARKET', 'ALTERNATIVE']
     banks = ['Goldman Sachs', 'JP Morgan', 'Bank of America', 'Wells Fargo', 'Citibank', 'HSBC']
     regions = ['North America', 'Europe', 'Asia Pacific', 'Latin America', 'Middle East']
+    companies = [fake.company() for _ in range(min(n, COMPANY_POOL_SIZE))]
     
-    for i in range(num_records):
-        # Generate random dates within the last year
-        valuation_date = fake.date_between(start_date='-1y', end_date='today')
-        
-        record = {
-            'valuationDt': valuation_date.isoformat(),
-            'shareClass': random.choice(share_classes),
-            'account': f"ACC{fake.random_number(digits=8)}",
-            'userBank': random.choice(banks),
-            'accountBaseCurrency': random.choice(currencies),
-            'accountName': f"{fake.company()} {random.choice(account_types)} Fund",
-            'acctBasis': random.choice(['GAAP', 'IFRS', 'STAT', 'TAX']),
-            'capstock': round(random.uniform(1000000, 100000000), 2),
-            'chartOfAccounts': f"COA_{fake.random_number(digits=4)}",
-            'distribution': round(random.uniform(0, 1000000), 2),
-            'eagleAcctBasis': random.choice(['GAAP', 'IFRS', 'STAT']),
-            'eagleClass': random.choice(share_classes),
-            'eagleEntityId': f"ENT_{fake.random_number(digits=6)}",
-            'eagleRegion': random.choice(regions),
-            'entityBaseCurrency': random.choice(currencies),
-            'incomeDistribution': round(random.uniform(0, 500000), 2),
-            'isComposite': random.choice([True, False]),
-            'isMulticlass': random.choice([True, False]),
-            'isPrimaryBasis': random.choice([True, False]),
-            'isSleeve': random.choice([True, False]),
-            'ltcglDistribution': round(random.uniform(0, 200000), 2),
-            'mergerPic': random.choice([None, f"MERGER_{fake.random_number(digits=4)}"]),
-            'parentAccount': f"PARENT_{fake.random_number(digits=6)}" if random.choice([True, False]) else None,
-            'settleCapstock': round(random.uniform(1000000, 100000000), 2),
-            'settleDistribution': round(random.uniform(0, 1000000), 2),
-            'shareClassCurrency': random.choice(currencies),
-            'NAV': round(random.uniform(10, 1000), 4),
-            'capstockRedsPay': round(random.uniform(0, 5000000), 2),
-            'capstockSubsRec': round(random.uniform(0, 5000000), 2),
-            'dailyDistribution': round(random.uniform(0, 10000), 2),
-            'dailyYeild': round(random.uniform(0, 0.1), 6),
-            'distributionPayable': round(random.uniform(0, 100000), 2),
-            'netAssets': round(random.uniform(10000000, 1000000000), 2),
-            'redemptionBalance': round(random.uniform(0, 10000000), 2),
-            'redemptionPayBase': round(random.uniform(0, 5000000), 2),
-            'redemptionPayLocal': round(random.uniform(0, 5000000), 2),
-            'reinvestmentDistribution': round(random.uniform(0, 500000), 2),
-            'settledShares': round(random.uniform(100000, 10000000), 0),
-            'sharesOutstanding': round(random.uniform(100000, 10000000), 0),
-            'subscriptionBalance': round(random.uniform(0, 10000000), 2),
-            'subscriptionRecBase': round(random.uniform(0, 5000000), 2),
-            'subscriptionRecLocal': round(random.uniform(0, 5000000), 2),
-            # Add metadata
-            'createdAt': datetime.utcnow().isoformat(),
-            'recordId': str(uuid.uuid4())
-        }
-        
-        data.append(record)
+    # Random dates within the last year
+    today = np.datetime64(date.today(), 'D')
+    valuation_dates = (today - rng.integers(0, 366, n)).astype(str).tolist()
+    
+    account_names = [
+        f"{company} {account_type} Fund"
+        for company, account_type in zip(_choices(companies, n), _choices(account_types, n))
+    ]
+    merger_pic = [pic if keep else None for pic, keep in zip(_ids("MERGER_", 4, n), _flags(n))]
+    parent_account = [parent if keep else None for parent, keep in zip(_ids("PARENT_", 6, n), _flags(n))]
+    
+    # One timestamp for the whole run, random version-4 record ids (JSON has
+    # no binary type; the importers store them as BSON binary UUIDs)
+    created_at = datetime.utcnow().isoformat()
+    raw_ids = rng.bytes(16 * n)
+    record_ids = [str(uuid.UUID(bytes=raw_ids[i:i + 16], version=4)) for i in range(0, 16 * n, 16)]
+    
+    columns = {
+        'valuationDt': valuation_dates,
+        'shareClass': _choices(share_classes, n),
+        'account': _ids("ACC", 8, n),
+        'userBank': _choices(banks, n),
+        'accountBaseCurrency': _choices(currencies, n),
+        'accountName': account_names,
+        'acctBasis': _choices(['GAAP', 'IFRS', 'STAT', 'TAX'], n),
+        'capstock': _amounts(1000000, 100000000, n),
+        'chartOfAccounts': _ids("COA_", 4, n),
+        'distribution': _amounts(0, 1000000, n),
+        'eagleAcctBasis': _choices(['GAAP', 'IFRS', 'STAT'], n),
+        'eagleClass': _choices(share_classes, n),
+        'eagleEntityId': _ids("ENT_", 6, n),
+        'eagleRegion': _choices(regions, n),
+        'entityBaseCurrency': _choices(currencies, n),
+        'incomeDistribution': _amounts(0, 500000, n),
+        'isComposite': _flags(n),
+        'isMulticlass': _flags(n),
+        'isPrimaryBasis': _flags(n),
+        'isSleeve': _flags(n),
+        'ltcglDistribution': _amounts(0, 200000, n),
+        'mergerPic': merger_pic,
+        'parentAccount': parent_account,
+        'settleCapstock': _amounts(1000000, 100000000, n),
+        'settleDistribution': _amounts(0, 1000000, n),
+        'shareClassCurrency': _choices(currencies, n),
+        'NAV': _amounts(10, 1000, n, 4),
+        'capstockRedsPay': _amounts(0, 5000000, n),
+        'capstockSubsRec': _amounts(0, 5000000, n),
+        'dailyDistribution': _amounts(0, 10000, n),
+        'dailyYeild': _amounts(0, 0.1, n, 6),
+        'distributionPayable': _amounts(0, 100000, n),
+        'netAssets': _amounts(10000000, 1000000000, n),
+        'redemptionBalance': _amounts(0, 10000000, n),
+        'redemptionPayBase': _amounts(0, 5000000, n),
+        'redemptionPayLocal': _amounts(0, 5000000, n),
+        'reinvestmentDistribution': _amounts(0, 500000, n),
+        'settledShares': _amounts(100000, 10000000, n, 0),
+        'sharesOutstanding': _amounts(100000, 10000000, n, 0),
+        'subscriptionBalance': _amounts(0, 10000000, n),
+        'subscriptionRecBase': _amounts(0, 5000000, n),
+        'subscriptionRecLocal': _amounts(0, 5000000, n),
+        # Add metadata
+        'createdAt': [created_at] * n,
+        'recordId': record_ids
+    }
     
-    return data
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*columns.values())]
 
 def create_json_output():
     """
@@ -111,8 +149,9 @@ def create_json_output():
     }
     
     # Save to JSON file
-    with open('/Volumes/D/Ai/python/dataset/dataNAV_sample.json', 'w') as f:
-        json.dump(collection_data, f, indent=2, default=str)
+    with open('/Volumes/D/Ai/python/dataset/dataNAV_sample.json', 'wb') as f:
+        f.write(orjson.dumps(collection_data, default=str,
+                             option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
     
     print(f"Sample data saved to dataNAV_sample.json")
     print(f"Generated {len(sample_data)} sample records")
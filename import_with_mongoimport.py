@@ -1,12 +1,16 @@
 #!/usr/bin/env python3
 """
-Alternative MongoDB import using mongoimport command
+Alternative MongoDB import using mongorestore with a BSON file
 Secure version using environment variables
 """
 
-import json
+import contextlib
 import subprocess
 import os
+import threading
+from bson import encode
+from bulk_insert import batched
+from import_to_mongodb import read_sample_data, convert_dates, convert_record_ids, INSERT_BATCH_SIZE
 
 def get_mongo_credentials():
     """Get MongoDB credentials from environment variables"""
@@ -19,65 +23,57 @@ def get_mongo_credentials():
 
 def import_with_mongoimport():
     """
-    Import JSON data using mongoimport command
+    Import JSON data by encoding it to BSON and loading it with mongorestore
     """
     creds = get_mongo_credentials()
     json_file = "/Volumes/D/Ai/python/dataset/dataNAV_sample.json"
     
-    # Read and process the JSON file
-    with open(json_file, 'r') as f:
-        data = json.load(f)
+    # Read and process the JSON file (streamed record by record when ijson is installed)
+    _, sample_data = read_sample_data(json_file)
     
-    sample_data = data['sample_data']
-    
-    # Create a temporary JSONL file for mongoimport
-    import_file = "/tmp/dataNAV_import.jsonl"
-    
-    with open(import_file, 'w') as f:
-        for record in sample_data:
-            # Convert date strings to proper format
-            if 'valuationDt' in record:
-                record['valuationDt'] = {"$date": record['valuationDt'] + "T00:00:00.000Z"}
-            if 'createdAt' in record:
-                record['createdAt'] = {"$date": record['createdAt']}
-            
-            json.dump(record, f)
-            f.write('\n')
-    
-    print(f"Created import file: {import_file}")
-    
-    # Use mongoimport via docker exec
+    # Use mongorestore via docker exec, reading BSON from stdin ("-")
     cmd = [
-        "docker", "exec", creds['container'],
-        "mongoimport",
+        "docker", "exec", "-i", creds['container'],
+        "mongorestore",
         "--username", creds['username'],
         "--password", creds['password'],
         "--authenticationDatabase", "admin",
         "--db", creds['database'],
         "--collection", "dataNAV",
-        "--file", "/tmp/dataNAV_import.jsonl",
-        "--drop"
-    ]
-    
-    # Copy file to container first
-    copy_cmd = [
-        "docker", "cp",
-        import_file,
-        "financial_data_mongodb:/tmp/dataNAV_import.jsonl"
+        "--drop",
+        "-"
     ]
     
     try:
-        print("Copying file to container...")
-        subprocess.run(copy_cmd, check=True, capture_output=True, text=True)
+        # Stream the records straight into the container, no temp file or docker cp;
+        # dates are encoded as native BSON dates, so no {"$date": ...} rewriting is needed.
+        print("Running mongorestore...")
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
         
-        print("Running mongoimport...")
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        # mongorestore reports progress and errors on stderr; drain it on a
+        # thread so it never blocks on a full pipe while we write stdin
+        stderr = []
+        reader = threading.Thread(target=lambda: stderr.append(proc.stderr.read()))
+        reader.start()
+        try:
+            for batch in batched(sample_data, INSERT_BATCH_SIZE):
+                proc.stdin.write(b''.join(encode(record) for record in convert_record_ids(convert_dates(batch))))
+        except BrokenPipeError:
+            # mongorestore exited early; its return code and message are reported below
+            pass
+        finally:
+            # Closing flushes any buffered data, which fails the same way if mongorestore has exited
+            with contextlib.suppress(BrokenPipeError):
+                proc.stdin.close()
+            proc.wait()
+            reader.join()
         
-        print("Import successful!")
-        print(result.stdout)
+        output = b''.join(stderr).decode(errors='replace')
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=output)
+        print(output, end='')
         
-        # Cleanup
-        os.remove(import_file)
+        print("Import successful!")
         
         # Verify import
         verify_cmd = [
@@ -95,9 +91,11 @@ def import_with_mongoimport():
         
     except subprocess.CalledProcessError as e:
         print(f"Error: {e}")
-        print(f"Stdout: {e.stdout}")
-        print(f"Stderr: {e.stderr}")
+        if e.stdout:
+            print(f"Stdout: {e.stdout}")
+        if e.stderr:
+            print(f"Stderr: {e.stderr}")
 
 if __name__ == "__main__":
-    print("=== MongoDB Import using mongoimport ===")
+    print("=== MongoDB Import using mongorestore ===")
     import_with_mongoimport()
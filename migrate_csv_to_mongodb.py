@@ -4,162 +4,165 @@ Script to migrate dynamicSubLedger.csv data to MongoDB collection
 """
 
 import csv
-import subprocess
-import json
 import os
 from datetime import datetime
+from itertools import chain
+from typing import Iterable, Iterator
+from pymongo import IndexModel, ASCENDING
+from pymongo.write_concern import WriteConcern
+from pymongo.errors import CollectionInvalid
+from bulk_insert import get_client, batched, insert_batches
 
-def read_csv_data(csv_file_path: str) -> list:
+# Documents per insert_many call (override with MIGRATION_BATCH_SIZE)
+INSERT_BATCH_SIZE = int(os.getenv('MIGRATION_BATCH_SIZE', '50'))
+
+# Concurrent insert_many calls (override with MIGRATION_WORKERS)
+INSERT_WORKERS = int(os.getenv('MIGRATION_WORKERS', '16'))
+
+# Send the bulk load unacknowledged (w=0) for throughput; set MIGRATION_UNACKNOWLEDGED=1
+# only for runs that are verified afterwards and don't need crash-safety
+UNACKNOWLEDGED_INGEST = bool(os.getenv('MIGRATION_UNACKNOWLEDGED'))
+
+def get_database():
     """
-    Read data from the dynamicSubLedger.csv file
+    Return the target MongoDB database, connecting on first use
+    
+    Returns:
+        pymongo Database for MONGO_DATABASE_NAME
+    """
+    client = get_client(os.getenv('MONGO_HOST', 'localhost'), os.getenv('MONGO_USERNAME', 'admin'),
+                        os.getenv('MONGO_PASSWORD', 'password123'), max_pool_size=max(100, INSERT_WORKERS))
+    return client[os.getenv('MONGO_DATABASE_NAME', 'financial_data')]
+
+def read_csv_data(csv_file_path: str) -> Iterator[dict]:
+    """
+    Stream data from the dynamicSubLedger.csv file one row at a time
     
     Args:
         csv_file_path: Path to the CSV file
         
-    Returns:
-        List of dictionaries containing the CSV data
+    Yields:
+        Dictionaries containing the CSV data
     """
-    csv_data = []
+    count = 0
+    # Every row gets the same migration timestamp
+    created_at = datetime.now().isoformat()
     
     try:
         with open(csv_file_path, 'r', newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
+            reader = csv.reader(csvfile)
+            header = [name.strip() for name in next(reader, [])]
             for row in reader:
-                # Clean up the row data
-                cleaned_row = {k.strip(): v.strip() if v else '' for k, v in row.items()}
+                if not row:
+                    continue
+                # Clean up the row data, filling missing trailing columns with ''
+                values = [value.strip() for value in row]
+                values.extend([''] * (len(header) - len(values)))
+                cleaned_row = dict(zip(header, values))
                 # Add metadata
-                cleaned_row['createdAt'] = datetime.now().isoformat()
+                cleaned_row['createdAt'] = created_at
                 cleaned_row['status'] = 'active'
-                csv_data.append(cleaned_row)
+                count += 1
+                yield cleaned_row
                 
-        print(f"Read {len(csv_data)} records from CSV file")
-        return csv_data
+        print(f"Read {count} records from CSV file")
         
     except FileNotFoundError:
         print(f"Error: CSV file not found: {csv_file_path}")
-        return []
     except Exception as e:
+        # Rows may already have been inserted, so the caller must see the failure
         print(f"Error reading CSV file: {e}")
-        return []
+        raise
 
 def create_collection_with_schema(container_name: str = "financial_data_mongodb"):
     """
     Create the derivedSubLedgerRollup collection with validation schema
     
     Args:
-        container_name: Name of the MongoDB Docker container
+        container_name: Name of the MongoDB Docker container (kept for reference only)
     """
-    # Get credentials from environment
-    username = os.getenv('MONGO_USERNAME', 'admin')
-    password = os.getenv('MONGO_PASSWORD', 'password123')
-    database = os.getenv('MONGO_DATABASE_NAME', 'financial_data')
     try:
         collection_name = "derivedSubLedgerRollup"
         
         # Create collection with validation schema
-        create_cmd = [
-            "docker", "exec", container_name,
-            "mongosh", "-u", username, "-p", password,
-            "--authenticationDatabase", "admin", database,
-            "--eval", f"""
-            db.createCollection('{collection_name}', {{
-              validator: {{
-                $jsonSchema: {{
-                  bsonType: 'object',
-                  required: ['ruleName', 'sourceTable', 'dataDefinition'],
-                  properties: {{
-                    ruleName: {{
-                      bsonType: 'string',
-                      description: 'Name of the rule - required'
-                    }},
-                    sourceTable: {{
-                      bsonType: 'string',
-                      description: 'Source table name - required'
-                    }},
-                    ledgerDefinition: {{
-                      bsonType: 'string',
-                      description: 'Ledger account definition'
-                    }},
-                    dataDefinition: {{
-                      bsonType: 'string',
-                      description: 'Formula definition - required'
-                    }},
-                    filter: {{
-                      bsonType: 'string',
-                      description: 'Filter condition'
-                    }},
-                    status: {{
-                      bsonType: 'string',
-                      enum: ['active', 'inactive', 'draft'],
-                      description: 'Status of the rule'
-                    }},
-                    createdAt: {{
-                      bsonType: 'string',
-                      description: 'Creation timestamp'
-                    }}
-                  }}
-                }}
-              }},
-              validationLevel: 'moderate',
-              validationAction: 'warn'
-            }});
-            print('Collection {collection_name} created successfully');
-            """,
-            "--quiet"
-        ]
+        get_database().create_collection(
+            collection_name,
+            validator={
+                '$jsonSchema': {
+                    'bsonType': 'object',
+                    'required': ['ruleName', 'sourceTable', 'dataDefinition'],
+                    'properties': {
+                        'ruleName': {
+                            'bsonType': 'string',
+                            'description': 'Name of the rule - required'
+                        },
+                        'sourceTable': {
+                            'bsonType': 'string',
+                            'description': 'Source table name - required'
+                        },
+                        'ledgerDefinition': {
+                            'bsonType': 'string',
+                            'description': 'Ledger account definition'
+                        },
+                        'dataDefinition': {
+                            'bsonType': 'string',
+                            'description': 'Formula definition - required'
+                        },
+                        'filter': {
+                            'bsonType': 'string',
+                            'description': 'Filter condition'
+                        },
+                        'status': {
+                            'bsonType': 'string',
+                            'enum': ['active', 'inactive', 'draft'],
+                            'description': 'Status of the rule'
+                        },
+                        'createdAt': {
+                            'bsonType': 'string',
+                            'description': 'Creation timestamp'
+                        }
+                    }
+                }
+            },
+            validationLevel='moderate',
+            validationAction='warn'
+        )
+        print(f"Collection '{collection_name}' created successfully")
+        return True
         
-        result = subprocess.run(create_cmd, capture_output=True, text=True)
-        
-        if result.returncode == 0:
-            print(f"Collection '{collection_name}' created successfully")
-            return True
-        else:
-            print(f"Error creating collection: {result.stderr}")
-            return False
-            
+    except CollectionInvalid:
+        print(f"Collection '{collection_name}' already exists")
+        return True
     except Exception as e:
         print(f"Error creating MongoDB collection: {e}")
         return False
 
-def insert_data_to_mongodb(collection_name: str, data: list, mongodb_container: str = "financial_data_mongodb") -> bool:
+def insert_data_to_mongodb(collection_name: str, data: Iterable[dict], mongodb_container: str = "financial_data_mongodb") -> bool:
     """
     Insert data into MongoDB collection
     
     Args:
         collection_name: Name of the collection
-        data: List of dictionaries to insert
-        mongodb_container: Name of the MongoDB Docker container
+        data: Dictionaries to insert, consumed in INSERT_BATCH_SIZE batches
+        mongodb_container: Name of the MongoDB Docker container (kept for reference only)
         
     Returns:
         True if successful, False otherwise
     """
     try:
-        # Convert data to JSON string for insertion
-        json_data = json.dumps(data, default=str)
+        # Insert directly over the driver connection
+        # Batches are sent concurrently over the shared connection pool
+        collection = get_database()[collection_name]
+        if UNACKNOWLEDGED_INGEST:
+            collection = collection.with_options(write_concern=WriteConcern(w=0))
+        # Raw CSV rows are not guaranteed to match the schema, so they go
+        # through the validator like any other write
+        inserted = insert_batches(collection, batched(data, INSERT_BATCH_SIZE), INSERT_WORKERS)
         
-        # Insert data using mongosh
-        insert_cmd = [
-            "docker", "exec", mongodb_container,
-            "mongosh", "-u", "admin", "-p", "password123",
-            "--authenticationDatabase", "admin", "financial_data",
-            "--eval", f"""
-            var data = {json_data};
-            var result = db.{collection_name}.insertMany(data);
-            print('Inserted ' + result.insertedIds.length + ' documents');
-            print('Total documents in collection: ' + db.{collection_name}.countDocuments({{}}));
-            """,
-            "--quiet"
-        ]
-        
-        result = subprocess.run(insert_cmd, capture_output=True, text=True)
-        
-        if result.returncode == 0:
-            print(f"Data inserted successfully into '{collection_name}'")
-            print(result.stdout)
-            return True
-        else:
-            print(f"Error inserting data: {result.stderr}")
-            return False
+        print(f"Data inserted successfully into '{collection_name}'")
+        print(f"Inserted {inserted} documents")
+        print(f"Total documents in collection: {collection.estimated_document_count()}")
+        return True
             
     except Exception as e:
         print(f"Error inserting data to MongoDB: {e}")
@@ -171,37 +174,23 @@ def create_indexes(collection_name: str, mongodb_container: str = "financial_dat
     
     Args:
         collection_name: Name of the collection
-        mongodb_container: Name of the MongoDB Docker container
+        mongodb_container: Name of the MongoDB Docker container (kept for reference only)
         
     Returns:
         True if successful, False otherwise
     """
     try:
-        index_cmd = [
-            "docker", "exec", mongodb_container,
-            "mongosh", "-u", "admin", "-p", "password123",
-            "--authenticationDatabase", "admin", "financial_data",
-            "--eval", f"""
-            // Create indexes for better performance
-            db.{collection_name}.createIndex({{ 'ruleName': 1 }});
-            db.{collection_name}.createIndex({{ 'sourceTable': 1 }});
-            db.{collection_name}.createIndex({{ 'status': 1 }});
-            db.{collection_name}.createIndex({{ 'ledgerDefinition': 1 }});
-            db.{collection_name}.createIndex({{ 'ruleName': 1, 'sourceTable': 1 }});
-            print('Indexes created successfully');
-            """,
-            "--quiet"
-        ]
-        
-        result = subprocess.run(index_cmd, capture_output=True, text=True)
+        # Create indexes for better performance
+        get_database()[collection_name].create_indexes([
+            IndexModel([('ruleName', ASCENDING)]),
+            IndexModel([('sourceTable', ASCENDING)]),
+            IndexModel([('status', ASCENDING)]),
+            IndexModel([('ledgerDefinition', ASCENDING)]),
+            IndexModel([('ruleName', ASCENDING), ('sourceTable', ASCENDING)]),
+        ])
+        print("Indexes created successfully")
+        return True
         
-        if result.returncode == 0:
-            print("Indexes created successfully")
-            return True
-        else:
-            print(f"Error creating indexes: {result.stderr}")
-            return False
-            
     except Exception as e:
         print(f"Error creating indexes: {e}")
         return False
@@ -212,47 +201,35 @@ def verify_migration(collection_name: str, mongodb_container: str = "financial_d
     
     Args:
         collection_name: Name of the collection
-        mongodb_container: Name of the MongoDB Docker container
+        mongodb_container: Name of the MongoDB Docker container (kept for reference only)
     """
     try:
-        verify_cmd = [
-            "docker", "exec", mongodb_container,
-            "mongosh", "-u", "admin", "-p", "password123",
-            "--authenticationDatabase", "admin", "financial_data",
-            "--eval", f"""
-            print('=== Collection Verification ===');
-            print('Collection: {collection_name}');
-            print('Total documents: ' + db.{collection_name}.countDocuments({{}}));
-            print('\\n=== Sample Documents ===');
-            db.{collection_name}.find().limit(3).forEach(function(doc) {{
-              print('Rule: ' + doc.ruleName + ', Source: ' + doc.sourceTable + ', Ledger: ' + doc.ledgerDefinition);
-              print('Formula: ' + doc.dataDefinition);
-              print('Filter: ' + doc.filter);
-              print('---');
-            }});
-            
-            print('\\n=== Collection Stats ===');
-            var stats = db.{collection_name}.aggregate([
-              {{$group: {{
-                _id: '$sourceTable',
-                count: {{$sum: 1}},
-                rules: {{$push: '$ruleName'}}
-              }}}}
-            ]);
-            stats.forEach(function(stat) {{
-              print('Source Table: ' + stat._id + ', Rules: ' + stat.count);
-            }});
-            
-            print('\\n=== Available Indexes ===');
-            db.{collection_name}.getIndexes().forEach(function(index) {{
-              print('Index: ' + index.name);
-            }});
-            """,
-            "--quiet"
-        ]
+        collection = get_database()[collection_name]
         
-        result = subprocess.run(verify_cmd, capture_output=True, text=True)
-        print("\n" + result.stdout)
+        print("\n=== Collection Verification ===")
+        print(f"Collection: {collection_name}")
+        print(f"Total documents: {collection.count_documents({})}")
+        
+        print("\n=== Sample Documents ===")
+        for doc in collection.find().limit(3):
+            print(f"Rule: {doc.get('ruleName')}, Source: {doc.get('sourceTable')}, Ledger: {doc.get('ledgerDefinition')}")
+            print(f"Formula: {doc.get('dataDefinition')}")
+            print(f"Filter: {doc.get('filter')}")
+            print("---")
+        
+        print("\n=== Collection Stats ===")
+        stats = collection.aggregate([
+            {'$group': {
+                '_id': '$sourceTable',
+                'count': {'$sum': 1}
+            }}
+        ])
+        for stat in stats:
+            print(f"Source Table: {stat['_id']}, Rules: {stat['count']}")
+        
+        print("\n=== Available Indexes ===")
+        for index in collection.list_indexes():
+            print(f"Index: {index['name']}")
         
     except Exception as e:
         print(f"Error verifying migration: {e}")
@@ -266,14 +243,20 @@ def migrate_csv_to_mongodb():
     csv_file_path = "/Volumes/D/Ai/python/dataset/dynamicSubledger.csv"
     collection_name = "derivedSubLedgerRollup"
     
-    # Step 1: Read CSV data
+    # Step 1: Read CSV data (streamed; peek at the first row to detect an empty file)
     csv_data = read_csv_data(csv_file_path)
-    if not csv_data:
+    try:
+        first_row = next(csv_data, None)
+    except Exception:
+        print("Failed to read CSV data")
+        return
+    if first_row is None:
         print("No data to migrate")
         return
+    csv_data = chain([first_row], csv_data)
     
     # Step 2: Create MongoDB collection
-    if not create_mongodb_collection(collection_name):
+    if not create_collection_with_schema():
         print("Failed to create collection")
         return
     
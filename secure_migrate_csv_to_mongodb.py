@@ -5,10 +5,15 @@ Secure version with environment variable support
 """
 
 import csv
-import subprocess
-import json
 import os
 from datetime import datetime
+from itertools import chain
+from typing import Iterable, Iterator
+import orjson
+from pymongo import IndexModel, ASCENDING
+from pymongo.write_concern import WriteConcern
+from pymongo.errors import CollectionInvalid
+from bulk_insert import get_client, batched, insert_batches
 
 class MongoCredentials:
     """Handle MongoDB credentials securely"""
@@ -18,68 +23,81 @@ class MongoCredentials:
         self.password = os.getenv('MONGO_PASSWORD', 'password123')
         self.database = os.getenv('MONGO_DATABASE_NAME', 'financial_data')
         self.container = os.getenv('MONGO_CONTAINER_NAME', 'financial_data_mongodb')
+        self.host = os.getenv('MONGO_HOST', 'localhost')
 
-def execute_mongo_command(creds: MongoCredentials, command: str) -> bool:
+# CSV columns kept in each migrated document, with the value used when a column is missing
+CSV_FIELDS = {
+    'ruleName': '',
+    'sourceTable': '',
+    'ledgerDefinition': '',
+    'dataDefinition': '',
+    'filter': 'none',
+}
+
+# Documents per insert_many call (override with MIGRATION_BATCH_SIZE)
+INSERT_BATCH_SIZE = int(os.getenv('MIGRATION_BATCH_SIZE', '50'))
+
+# Concurrent insert_many calls (override with MIGRATION_WORKERS)
+INSERT_WORKERS = int(os.getenv('MIGRATION_WORKERS', '16'))
+
+# Send the bulk load unacknowledged (w=0) for throughput; set MIGRATION_UNACKNOWLEDGED=1
+# only for runs that are verified afterwards and don't need crash-safety
+UNACKNOWLEDGED_INGEST = bool(os.getenv('MIGRATION_UNACKNOWLEDGED'))
+
+def get_database(creds: MongoCredentials):
     """
-    Execute a MongoDB command via mongosh
+    Return the target MongoDB database, connecting on first use
     
     Args:
         creds: MongoDB credentials object
-        command: MongoDB command to execute
         
     Returns:
-        True if successful, False otherwise
+        pymongo Database for the configured database name
     """
-    try:
-        cmd = [
-            "docker", "exec", creds.container,
-            "mongosh", "-u", creds.username, "-p", creds.password,
-            "--authenticationDatabase", "admin", creds.database,
-            "--eval", command,
-            "--quiet"
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            print(f"MongoDB command error: {result.stderr}")
-            return False
-            
-        return True
-        
-    except Exception as e:
-        print(f"Error executing MongoDB command: {e}")
-        return False
+    client = get_client(creds.host, creds.username, creds.password, max_pool_size=max(100, INSERT_WORKERS))
+    return client[creds.database]
 
-def read_csv_data(csv_file_path: str) -> list:
+def read_csv_data(csv_file_path: str) -> Iterator[dict]:
     """
-    Read data from the dynamicSubLedger.csv file
+    Stream the dynamicSubLedger.csv file as migration-ready documents
     
     Args:
         csv_file_path: Path to the CSV file
         
-    Returns:
-        List of dictionaries containing the CSV data
+    Yields:
+        Documents in the derivedSubLedgerRollup shape
     """
-    data = []
+    count = 0
+    # Every document gets the same migration timestamp
+    created_at = datetime.now().isoformat()
     
     try:
         with open(csv_file_path, 'r', newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
+            reader = csv.reader(csvfile)
+            header = [name.strip() for name in next(reader, [])]
+            # Column position of each kept field (None when the CSV lacks it);
+            # only these values are cleaned, the rest of the row is ignored
+            columns = [(field, header.index(field) if field in header else None, default)
+                       for field, default in CSV_FIELDS.items()]
             for row in reader:
-                # Clean up the row data
-                cleaned_row = {k.strip(): v.strip() if v else '' for k, v in row.items()}
-                data.append(cleaned_row)
+                if not row:
+                    continue
+                document = {}
+                for field, position, default in columns:
+                    document[field] = row[position].strip() if position is not None and position < len(row) else default
+                document['status'] = 'active'
+                document['createdAt'] = created_at
+                count += 1
+                yield document
                 
-        print(f"Read {len(data)} records from CSV file")
-        return data
+        print(f"Read {count} records from CSV file")
         
     except FileNotFoundError:
         print(f"Error: CSV file not found: {csv_file_path}")
-        return []
     except Exception as e:
+        # Rows may already have been inserted, so the caller must see the failure
         print(f"Error reading CSV file: {e}")
-        return []
+        raise
 
 def create_collection_with_schema(creds: MongoCredentials, collection_name: str = "derivedSubLedgerRollup") -> bool:
     """
@@ -92,123 +110,113 @@ def create_collection_with_schema(creds: MongoCredentials, collection_name: str
     Returns:
         True if successful, False otherwise
     """
-    command = f"""
-    try {{
-        db.createCollection('{collection_name}', {{
-          validator: {{
-            $jsonSchema: {{
-              bsonType: 'object',
-              required: ['ruleName', 'sourceTable', 'dataDefinition'],
-              properties: {{
-                ruleName: {{
-                  bsonType: 'string',
-                  description: 'Name of the ledger rule'
-                }},
-                sourceTable: {{
-                  bsonType: 'string',
-                  description: 'Source table/collection name'
-                }},
-                ledgerDefinition: {{
-                  bsonType: 'string',
-                  description: 'Target ledger account'
-                }},
-                dataDefinition: {{
-                  bsonType: 'string',
-                  description: 'Formula/calculation definition'
-                }},
-                filter: {{
-                  bsonType: 'string',
-                  description: 'Filter condition for the rule'
-                }},
-                status: {{
-                  bsonType: 'string',
-                  enum: ['active', 'inactive'],
-                  description: 'Status of the rule'
-                }},
-                createdAt: {{
-                  bsonType: 'string',
-                  description: 'Creation timestamp'
-                }}
-              }}
-            }}
-          }}
-        }});
-        
-        // Create indexes for better performance
-        db.{collection_name}.createIndex({{ "ruleName": 1 }});
-        db.{collection_name}.createIndex({{ "sourceTable": 1 }});
-        db.{collection_name}.createIndex({{ "status": 1 }});
-        
-        print('Collection {collection_name} created successfully with validation schema');
+    try:
+        get_database(creds).create_collection(collection_name, validator={
+            '$jsonSchema': {
+                'bsonType': 'object',
+                'required': ['ruleName', 'sourceTable', 'dataDefinition'],
+                'properties': {
+                    'ruleName': {
+                        'bsonType': 'string',
+                        'description': 'Name of the ledger rule'
+                    },
+                    'sourceTable': {
+                        'bsonType': 'string',
+                        'description': 'Source table/collection name'
+                    },
+                    'ledgerDefinition': {
+                        'bsonType': 'string',
+                        'description': 'Target ledger account'
+                    },
+                    'dataDefinition': {
+                        'bsonType': 'string',
+                        'description': 'Formula/calculation definition'
+                    },
+                    'filter': {
+                        'bsonType': 'string',
+                        'description': 'Filter condition for the rule'
+                    },
+                    'status': {
+                        'bsonType': 'string',
+                        'enum': ['active', 'inactive'],
+                        'description': 'Status of the rule'
+                    },
+                    'createdAt': {
+                        'bsonType': 'string',
+                        'description': 'Creation timestamp'
+                    }
+                }
+            }
+        })
+        print(f"Collection {collection_name} created successfully with validation schema")
         
-    }} catch (e) {{
-        if (e.codeName === 'NamespaceExists') {{
-            print('Collection {collection_name} already exists');
-        }} else {{
-            print('Error creating collection: ' + e.message);
-            throw e;
-        }}
-    }}
-    """
-    
-    if execute_mongo_command(creds, command):
-        print(f"Collection '{collection_name}' setup completed successfully")
-        return True
-    else:
+    except CollectionInvalid:
+        print(f"Collection {collection_name} already exists")
+    except Exception as e:
+        print(f"Error creating collection: {e}")
         print(f"Failed to create collection '{collection_name}'")
         return False
+    
+    print(f"Collection '{collection_name}' setup completed successfully")
+    return True
 
-def migrate_data_to_mongodb(creds: MongoCredentials, csv_data: list, collection_name: str = "derivedSubLedgerRollup") -> bool:
+def migrate_data_to_mongodb(creds: MongoCredentials, csv_data: Iterable[dict], collection_name: str = "derivedSubLedgerRollup") -> bool:
     """
     Migrate CSV data to MongoDB collection
     
     Args:
         creds: MongoDB credentials
-        csv_data: List of CSV records
+        csv_data: Documents from read_csv_data, consumed in INSERT_BATCH_SIZE batches
         collection_name: Target collection name
         
     Returns:
         True if successful, False otherwise
     """
     try:
-        # Convert CSV data to MongoDB documents
-        documents = []
-        for row in csv_data:
-            doc = {
-                'ruleName': row.get('ruleName', ''),
-                'sourceTable': row.get('sourceTable', ''),
-                'ledgerDefinition': row.get('ledgerDefinition', ''),
-                'dataDefinition': row.get('dataDefinition', ''),
-                'filter': row.get('filter', 'none'),
-                'status': 'active',
-                'createdAt': datetime.now().isoformat()
-            }
-            documents.append(doc)
-        
-        # Create the insert command
-        docs_json = json.dumps(documents, indent=2)
-        command = f"""
-        try {{
-            var docs = {docs_json};
-            var result = db.{collection_name}.insertMany(docs);
-            print('Inserted ' + result.insertedIds.length + ' documents');
-        }} catch (e) {{
-            print('Error inserting documents: ' + e.message);
-            throw e;
-        }}
-        """
-        
-        if execute_mongo_command(creds, command):
-            print(f"Successfully migrated {len(documents)} records to '{collection_name}' collection")
-            return True
-        else:
-            print("Failed to migrate data to MongoDB")
-            return False
+        # Insert directly over the driver connection;
+        # batches are sent concurrently over the shared connection pool
+        collection = get_database(creds)[collection_name]
+        if UNACKNOWLEDGED_INGEST:
+            collection = collection.with_options(write_concern=WriteConcern(w=0))
+        # read_csv_data builds every document in the schema's shape, so the
+        # $jsonSchema validator is skipped for the bulk load only; regular
+        # application writes to the collection are still validated
+        inserted = insert_batches(collection, batched(csv_data, INSERT_BATCH_SIZE), INSERT_WORKERS,
+                                  bypass_validation=True)
+        print(f"Successfully migrated {inserted} records to '{collection_name}' collection")
+        return True
             
     except Exception as e:
         print(f"Error migrating data: {e}")
         return False
 
+def create_indexes_after_load(creds: MongoCredentials, collection_name: str = "derivedSubLedgerRollup") -> bool:
+    """
+    Create the collection indexes once the data is loaded
+    
+    Building after the bulk insert lets the server build each index in one
+    sorted pass instead of updating it for every inserted document.
+    
+    Args:
+        creds: MongoDB credentials
+        collection_name: Collection to index
+        
+    Returns:
+        True if successful, False otherwise
+    """
+    try:
+        names = get_database(creds)[collection_name].create_indexes([
+            IndexModel([("ruleName", ASCENDING)]),
+            IndexModel([("sourceTable", ASCENDING)]),
+            IndexModel([("status", ASCENDING)]),
+        ])
+        print(f"Created indexes on '{collection_name}': {', '.join(names)}")
+        return True
+        
+    except Exception as e:
+        print(f"Error creating indexes: {e}")
+        return False
+
 def verify_migration(creds: MongoCredentials, collection_name: str = "derivedSubLedgerRollup") -> bool:
     """
     Verify the migration by checking document count and sample data
@@ -220,27 +228,21 @@ def verify_migration(creds: MongoCredentials, collection_name: str = "derivedSub
     Returns:
         True if verification passes, False otherwise
     """
-    command = f"""
-    try {{
-        var count = db.{collection_name}.countDocuments();
-        print('Total documents in {collection_name}: ' + count);
+    try:
+        collection = get_database(creds)[collection_name]
+        count = collection.count_documents({})
+        print(f"Total documents in {collection_name}: {count}")
+        
+        if count > 0:
+            print("\nSample documents:")
+            for doc in collection.find().limit(2):
+                print(orjson.dumps(doc, default=str, option=orjson.OPT_INDENT_2).decode())
         
-        if (count > 0) {{
-            print('\\nSample documents:');
-            db.{collection_name}.find().limit(2).forEach(function(doc) {{
-                print(JSON.stringify(doc, null, 2));
-            }});
-        }}
-    }} catch (e) {{
-        print('Error verifying migration: ' + e.message);
-        throw e;
-    }}
-    """
-    
-    if execute_mongo_command(creds, command):
         print(f"Migration verification completed for '{collection_name}' collection")
         return True
-    else:
+        
+    except Exception as e:
+        print(f"Error verifying migration: {e}")
         print("Failed to verify migration")
         return False
 
@@ -253,7 +255,7 @@ def main():
     
     # Initialize credentials
     creds = MongoCredentials()
-    print(f"Connecting to MongoDB container: {creds.container}")
+    print(f"Connecting to MongoDB host: {creds.host}")
     print(f"Database: {creds.database}")
     print(f"Username: {creds.username}")
     
@@ -261,13 +263,19 @@ def main():
     csv_file_path = "/Volumes/D/Ai/python/dataset/dynamicSubledger.csv"
     collection_name = "derivedSubLedgerRollup"
     
-    # Step 1: Read CSV data
+    # Step 1: Read CSV data (streamed; peek at the first row to detect an empty file)
     print(f"\\nStep 1: Reading CSV file: {csv_file_path}")
     csv_data = read_csv_data(csv_file_path)
+    try:
+        first_row = next(csv_data, None)
+    except Exception:
+        print("Failed to read CSV file. Exiting.")
+        return
     
-    if not csv_data:
+    if first_row is None:
         print("No data to migrate. Exiting.")
         return
+    csv_data = chain([first_row], csv_data)
     
     # Step 2: Create collection with schema
     print(f"\\nStep 2: Creating collection '{collection_name}' with validation schema")
@@ -276,13 +284,19 @@ def main():
         return
     
     # Step 3: Migrate data
-    print(f"\\nStep 3: Migrating {len(csv_data)} records to MongoDB")
+    print(f"\\nStep 3: Migrating records to MongoDB")
     if not migrate_data_to_mongodb(creds, csv_data, collection_name):
         print("Migration failed. Exiting.")
         return
     
-    # Step 4: Verify migration
-    print(f"\\nStep 4: Verifying migration")
+    # Step 4: Create indexes
+    print(f"\\nStep 4: Creating indexes")
+    if not create_indexes_after_load(creds, collection_name):
+        print("Failed to create indexes. Exiting.")
+        return
+    
+    # Step 5: Verify migration
+    print(f"\\nStep 5: Verifying migration")
     if verify_migration(creds, collection_name):
         print("\\n✅ Migration completed successfully!")
         print(f"\\nNext steps:")
@@ -46,6 +46,10 @@ def test_formula_calculation():
         ("[dailyYeild] * 100", 2.5)
     ]
     
+    # Compile every formula in one pass; apply_formula then reuses the cached functions
+    for formula, _ in test_cases:
+        processor.compile_formula(formula)
+    
     for formula, expected in test_cases:
         result = processor.apply_formula(formula, test_data)
         status = "✓" if abs(result - expected) < 0.01 else "✗"
@@ -72,34 +76,62 @@ def test_mongodb_query_building():
         print(f"Fields: {fields}")
         print(f"Query: {query}\n")
 
-def create_test_csv():
-    """Create a test CSV file with various scenarios"""
-    print("=== Creating Test CSV ===")
-    
-    test_csv_content = """ruleName,sourceTable,ledgerDefinition,dataDefinition,filter
-Simple Multiplication,dataNAV,3001000100,"[subscriptionBalance] * 2",none
-Addition Formula,dataNAV,3001000200,"[redemptionBalance] + [redemptionPayBase]",none
-Division Formula,dataNAV,3001000300,"[netAssets] / [sharesOutstanding]",none
-Filtered by Class,dataNAV,3001000400,"[netAssets]","shareClass='A'"
-Filtered by Currency,dataNAV,3001000500,"[dailyYeild] * 365","accountBaseCurrency='USD'"
-Boolean Filter,dataNAV,3001000600,"[capstock] + [settleCapstock]","isComposite=true"
-Complex Formula,dataNAV,3001000700,"([incomeDistribution] - [ltcglDistribution]) * 1.2",none"""
-    
-    with open('/Volumes/D/Ai/python/dataset/test_dynamicSubledger.csv', 'w') as f:
-        f.write(test_csv_content)
-    
-    print("Test CSV created: test_dynamicSubledger.csv")
+def test_filter_parsing():
+    """Test filter parsing into MongoDB match documents"""
+    print("=== Testing Filter Parsing ===")
+    
+    processor = DynamicSubLedgerProcessor("dummy.csv")
+    
+    test_cases = [
+        ("none", {}),
+        ("shareClass='A'", {'shareClass': 'A'}),
+        ("isComposite=true", {'isComposite': True}),
+        ("NAV >= 100.5 AND accountBaseCurrency='USD'", {'NAV': {'$gte': 100.5}, 'accountBaseCurrency': 'USD'}),
+        ("shareClass='A' OR shareClass='B'", {'$or': [{'shareClass': 'A'}, {'shareClass': 'B'}]}),
+        ("accountName='Growth and Income' AND isSleeve != false", {'accountName': 'Growth and Income', 'isSleeve': {'$ne': False}}),
+        ("eagleRegion=North America", {'eagleRegion': 'North America'}),
+        ("eagleRegion = Asia Pacific AND shareClass=A", {'eagleRegion': 'Asia Pacific', 'shareClass': 'A'}),
+        ("eagleRegion=Latin America OR eagleRegion=Middle East", {'$or': [{'eagleRegion': 'Latin America'}, {'eagleRegion': 'Middle East'}]})
+    ]
+    
+    for filter_condition, expected in test_cases:
+        match = processor.parse_filter(filter_condition)
+        print(f"Filter: {filter_condition}")
+        print(f"Match: {match}\n")
+        assert match == expected
+    
+    # Unparseable filters are rejected rather than matching every document
+    for filter_condition in ["shareClass='A' AND", "shareClass", "shareClass='A' isSleeve=true"]:
+        try:
+            processor.parse_filter(filter_condition)
+        except ValueError as e:
+            print(f"Rejected: {e}")
+        else:
+            raise AssertionError(f"Filter was not rejected: {filter_condition}")
 
 def run_test_scenario():
     """Run a complete test scenario"""
     print("=== Running Complete Test Scenario ===")
     
-    create_test_csv()
+    # Rules covering various scenarios, passed in memory
+    rules = [
+        {'ruleName': 'Simple Multiplication', 'sourceTable': 'dataNAV', 'ledgerDefinition': '3001000100',
+         'dataDefinition': '[subscriptionBalance] * 2', 'filter': 'none'},
+        {'ruleName': 'Addition Formula', 'sourceTable': 'dataNAV', 'ledgerDefinition': '3001000200',
+         'dataDefinition': '[redemptionBalance] + [redemptionPayBase]', 'filter': 'none'},
+        {'ruleName': 'Division Formula', 'sourceTable': 'dataNAV', 'ledgerDefinition': '3001000300',
+         'dataDefinition': '[netAssets] / [sharesOutstanding]', 'filter': 'none'},
+        {'ruleName': 'Filtered by Class', 'sourceTable': 'dataNAV', 'ledgerDefinition': '3001000400',
+         'dataDefinition': '[netAssets]', 'filter': "shareClass='A'"},
+        {'ruleName': 'Filtered by Currency', 'sourceTable': 'dataNAV', 'ledgerDefinition': '3001000500',
+         'dataDefinition': '[dailyYeild] * 365', 'filter': "accountBaseCurrency='USD'"},
+        {'ruleName': 'Boolean Filter', 'sourceTable': 'dataNAV', 'ledgerDefinition': '3001000600',
+         'dataDefinition': '[capstock] + [settleCapstock]', 'filter': 'isComposite=true'},
+        {'ruleName': 'Complex Formula', 'sourceTable': 'dataNAV', 'ledgerDefinition': '3001000700',
+         'dataDefinition': '([incomeDistribution] - [ltcglDistribution]) * 1.2', 'filter': 'none'}
+    ]
     
-    # Process the test CSV
-    processor = DynamicSubLedgerProcessor(
-        csv_file_path="/Volumes/D/Ai/python/dataset/test_dynamicSubledger.csv"
-    )
+    processor = DynamicSubLedgerProcessor(rules=rules)
     
     results = processor.process_all_definitions()
     
@@ -116,4 +148,5 @@ if __name__ == "__main__":
     test_formula_parsing()
     test_formula_calculation()
     test_mongodb_query_building()
+    test_filter_parsing()
     run_test_scenario()
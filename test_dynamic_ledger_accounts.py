@@ -11,6 +11,10 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from dynamicSubLedger import DynamicSubLedgerProcessor
 
+# Report separator lines
+SEPARATOR = '=' * 80
+DIVIDER = '-' * 60
+
 def test_dynamic_ledger_accounts():
     """
     Test the dynamic ledger account resolution functionality
@@ -71,14 +75,14 @@ def test_dynamic_ledger_accounts():
               f"AccountType={sample['accountType']}, "
               f"CategoryCode={sample['categoryCode']}")
     
-    print(f"\n{'='*80}")
+    print(f"\n{SEPARATOR}")
     
     # Test each ledger definition pattern
     for test_case in test_cases:
         print(f"\nTest: {test_case['name']}")
         print(f"Description: {test_case['description']}")
         print(f"Ledger Definition: '{test_case['ledger_definition']}'")
-        print(f"{'-'*60}")
+        print(DIVIDER)
         
         for i, data in enumerate(test_data_samples, 1):
             resolved = processor.resolve_ledger_account(test_case['ledger_definition'], data)
@@ -87,9 +91,9 @@ def test_dynamic_ledger_accounts():
         print()
     
     # Test field extraction for ledger definitions
-    print(f"{'='*80}")
+    print(SEPARATOR)
     print("Field Extraction Test:")
-    print(f"{'='*80}")
+    print(SEPARATOR)
     
     ledger_patterns = [
         '3002000110',
@@ -107,9 +111,9 @@ def test_integration_with_processing():
     """
     Test how dynamic ledger accounts work in the full processing pipeline
     """
-    print(f"\n{'='*80}")
+    print(f"\n{SEPARATOR}")
     print("Integration Test - Simulated Processing")
-    print(f"{'='*80}")
+    print(SEPARATOR)
     
     processor = DynamicSubLedgerProcessor()
     
@@ -164,6 +168,44 @@ def test_integration_with_processing():
     for key, value in entry.items():
         print(f"  {key}: {value}")
 
+def test_embedded_template_entries():
+    """
+    Test that ledger templates with embedded fields are resolved by the processing pipeline
+    """
+    print(f"\n{SEPARATOR}")
+    print("Embedded Template Test - generate_ledger_entries")
+    print(SEPARATOR)
+    
+    processor = DynamicSubLedgerProcessor()
+    
+    definitions = [
+        {'ruleName': 'Embedded', 'sourceTable': 'dataNAV', 'ledgerDefinition': '300[categoryCode]001',
+         'dataDefinition': '[subscriptionBalance] * -1', 'filter': 'none'},
+        {'ruleName': 'Two Fields', 'sourceTable': 'dataNAV', 'ledgerDefinition': '[accountType]_[categoryCode]',
+         'dataDefinition': '[subscriptionBalance]', 'filter': 'none'}
+    ]
+    group = processor.prepare_rule_group(definitions)
+    
+    # The lookup fields are projected and carried through the $group stage
+    projection = next(stage['$project'] for stage in group['pipeline'] if '$project' in stage)
+    assert 'categoryCode' in projection and 'accountType' in projection
+    
+    query_result = {
+        '_id': {'valuationDt': '2024-08-19', 'account': 'ACC123'},
+        'eagleEntityId': 'ENT_001',
+        'subscriptionBalance': 1500000,
+        'categoryCode': '200',
+        'accountType': 'EQUITY'
+    }
+    entries = list(processor.generate_ledger_entries(group, [query_result]))
+    
+    accounts = [entry['eagleLedgerAcct'] for entry in entries]
+    print(f"Resolved accounts: {accounts}")
+    assert accounts == ['300200001', 'EQUITY_200']
+    assert [entry['ledgerDefinitionType'] for entry in entries] == ['dynamic', 'dynamic']
+    assert entries[0]['sourceData']['categoryCode'] == '200'
+
 if __name__ == "__main__":
     test_dynamic_ledger_accounts()
     test_integration_with_processing()
+    test_embedded_template_entries()